@@ -1,52 +1,98 @@
-# import os
+import os
+import re
 #
-# import numpy as np
+import numpy as np
 # import pylab as pl
-# from matplotlib import pyplot as plt
+from matplotlib import pyplot as plt
 # from matplotlib.animation import FuncAnimation
-# from backend import preprocessor
+from backend import preprocessor
 # from sklearn.preprocessing import OrdinalEncoder
 # from textblob import TextBlob
 from urlextract import URLExtract
-# import emoji
-# import streamlit as st
+import emoji
+import streamlit as st
 import plotly.express as px
-# import pandas as pd
+import pandas as pd
 import nltk
-from wordcloud import WordCloud
+from nltk.sentiment.vader import SentimentIntensityAnalyzer
+import plotly.graph_objects as go
+from wordcloud import WordCloud, STOPWORDS
+from collections import Counter
+from functools import lru_cache
+import heapq
+import weakref
+from concurrent.futures import ProcessPoolExecutor
 
 # from pandasai import SmartDataframe
 # from pandasai.llm import OpenAI
 
 extract = URLExtract()
+
+# One stop word per entry, lines like 'image omitted' add both of their words
+with open(os.path.join(os.path.dirname(__file__), 'stop_hinglish.txt'), 'r') as f:
+    STOP_WORDS = frozenset(f.read().lower().split())
+
 nltk.download('vader_lexicon')
 
+
+# Results worked out for a frame, keyed by id(frame). The entry is dropped when the frame
+# is garbage collected, so an id is never reused while its results are still stored.
+# Nothing is put on the frame itself, filtered frames and copies start without results
+_FRAME_CACHES = {}
+
+
+def frame_cache(df):
+    key = id(df)
+    cache = _FRAME_CACHES.get(key)
+    if cache is None:
+        cache = _FRAME_CACHES[key] = {}
+        weakref.finalize(df, _FRAME_CACHES.pop, key, None)
+    return cache
+
+
 def fetch_stats(selected_user,df):
+    # The stats of every user are worked out once per frame, afterwards this is a lookup
+    stats = user_stats(df)
+    if selected_user not in stats.index:
+        return 0, 0, 0, 0
 
-    if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
+    num_messages, num_words, num_media_messages, num_links = stats.loc[selected_user]
+    return num_messages, num_words, num_media_messages, num_links
 
-    # fetch the number of messages
-    num_messages = df.shape[0]
 
-    # fetch the total number of words
-    words = []
-    for message in df['message']:
-        words.extend(message.split())
+def user_stats(df):
+    """Messages, words, media and links for every user and 'Overall', cached per frame."""
+    cache = frame_cache(df)
+    if 'user_stats' in cache:
+        return cache['user_stats']
 
-    # # fetch number of media messages
-    # # Fetch number of media messages (either '<Media omitted>\n' or 'image omitted')
-    # num_media_messages = df[(df['message'] == '<Media omitted>\n')].shape[0]
+    messages = df['message']
+    per_message = pd.DataFrame({
+        'messages': 1,
+        # fetch the total number of words
+        'words': messages.str.count(r'\S+'),
+        # Fetch number of media messages (either '<Media omitted>\n', 'video omitted', or 'image omitted')
+        'media': messages.str.contains('<Media omitted>|video omitted|image omitted'),
+        # fetch number of links shared
+        'links': count_links(messages),
+    }, index=df.index)
 
-    # Fetch number of media messages (either '<Media omitted>\n', 'video omitted', or 'image omitted')
-    num_media_messages = df[df['message'].str.contains('<Media omitted>|video omitted|image omitted')].shape[0]
+    stats = per_message.groupby(df['user'].values, observed=True).sum().astype(int)
+    stats.loc['Overall'] = stats.sum()
+    cache['user_stats'] = stats
+    return stats
 
-    # fetch number of links shared
-    links = []
-    for message in df['message']:
-        links.extend(extract.find_urls(message))
 
-    return num_messages,len(words),num_media_messages,len(links)
+# Every URL URLExtract can find has a TLD after a dot (or is localhost), so
+# messages without one can skip the extractor
+LINK_CANDIDATE = r'\.\w|localhost'
+
+
+def count_links(messages):
+    candidates = messages.str.contains(LINK_CANDIDATE, case=False, regex=True).values
+    links = np.zeros(len(messages), dtype=int)
+    links[candidates] = [len(extract.find_urls(message)) for message in messages[candidates]]
+    return pd.Series(links, index=messages.index)
 
 
 def most_busy_users(df):
@@ -55,28 +101,97 @@ def most_busy_users(df):
         columns={'index': 'name', 'user': 'percent'})
     return x,df
 
-def create_wordcloud(selected_user,df):
+def create_wordcloud(selected_user,df,width=500,height=500):
+
+    # Rendered clouds are kept per user, size and stop list, switching back is free
+    cache = frame_cache(df)
+    key = ('wordcloud', selected_user, width, height, hash(STOP_WORDS))
+    if key in cache:
+        return cache[key]
+
+    wc = WordCloud(width=width,height=height,min_font_size=10,background_color='white')
+    df_wc = wc.generate_from_frequencies(user_word_frequencies(selected_user, df))
+    cache[key] = df_wc
+    return df_wc
+
+
+def user_word_frequencies(selected_user, df):
+    frequencies = word_frequencies(df)
+    if selected_user == 'Overall':
+        frequencies = frequencies.groupby(level='token').sum()
+    elif selected_user in frequencies.index.get_level_values('user'):
+        frequencies = frequencies.xs(selected_user, level='user')
+    else:
+        frequencies = frequencies.iloc[:0]
+    return frequencies.to_dict()
+
+
+WORDCLOUD_TOKEN = r"\w[\w']*"
+
+
+def word_frequencies(df):
+    """Counts of every (user, word) pair, worked out once per frame."""
+    cache = frame_cache(df)
+    if 'word_frequencies' in cache:
+        return cache['word_frequencies']
+
+    index = token_index(df)
+    keep = (index['counted'] & ~index['token'].isin(STOP_WORDS)).values
+
+    # Split the way WordCloud.generate does, "ok," and "ok" are one word, a trailing 's
+    # is dropped and numbers and WordCloud's own stop words are left out
+    words = index['token'][keep].str.findall(WORDCLOUD_TOKEN)
+    words.index = index['user'].values[keep]
+    words = words.explode().dropna().str.replace(r"'s$", '', regex=True)
+    words = words[~words.str.isdigit() & ~words.isin(STOPWORDS)]
+    frequencies = words.groupby([words.index.astype(str), words.values]).size()
+    frequencies.index.names = ['user', 'token']
+    cache['word_frequencies'] = frequencies
+    return frequencies
+
+
+def most_common_words(selected_user,df):
 
-    f = open('backend/stop_hinglish.txt', 'r')
-    stop_words = f.read()
+    most_common_df = pd.DataFrame(Counter(word_tokens(selected_user, df)).most_common(20),
+                                  columns=['Word', 'Frequency'])
+    return most_common_df
 
+
+def word_tokens(selected_user, df):
+    # Tokens of the user's own text messages without stop words
+    index = token_index(df)
+    keep = index['counted'].values & ~index['token'].isin(STOP_WORDS).values
     if selected_user != 'Overall':
-        df = df[df['user'] == selected_user]
+        keep &= (index['user'] == selected_user).values
+    return index['token'].values[keep]
 
-    temp = df[df    ['user'] != 'group_notification']
-    temp = temp[temp['message'] != '<Media omitted>\n']
 
-    def remove_stop_words(message):
-        y = []
-        for word in message.lower().split():
-            if word not in stop_words:
-                y.append(word)
-        return " ".join(y)
+def token_index(df):
+    """Lower-cased tokens of every message with the position and user of their message.
+
+    Built once per frame and cached, 'counted' is False for group notifications
+    and media placeholders, which the word based views leave out.
+    """
+    cache = frame_cache(df)
+    if 'token_index' in cache:
+        return cache['token_index']
+
+    tokens = df['message'].str.lower().str.split()
+    tokens.index = np.arange(df.shape[0])
+    tokens = tokens.explode().dropna()
+    positions = tokens.index.values
+
+    counted = ((df['user'] != 'group_notification') & (df['message'] != '<Media omitted>\n')).values
+    index = pd.DataFrame({
+        'position': positions,
+        'user': df['user'].values[positions],
+        'token': tokens.values.astype(str),
+        'counted': counted[positions],
+    })
+    cache['token_index'] = index
+    return index
+
 
-    wc = WordCloud(width=500,height=500,min_font_size=10,background_color='white')
-    temp['message'] = temp['message'].apply(remove_stop_words)
-    df_wc = wc.generate(temp['message'].str.cat(sep=" "))
-    return df_wc
 #
 #
 # from wordcloud import WordCloud,STOPWORDS
@@ -149,86 +264,140 @@ def create_wordcloud(selected_user,df):
 #     return plotly_wordcloud(wordcloud_text)
 #
 #
-# def most_common_words(selected_user,df):
-#
-#     f = open('backend/stop_hinglish.txt','r')
-#     stop_words = f.read()
-#
-#     if selected_user != 'Overall':
-#         df = df[df['user'] == selected_user]
-#
-#     temp = df[df['user'] != 'group_notification']
-#     temp = temp[temp['message'] != '<Media omitted>\n']
-#
-#     words = []
-#
-#     for message in temp['message']:
-#         for word in message.lower().split():
-#             if word not in stop_words:
-#                 words.append(word)
-#
-#     most_common_df = pd.DataFrame(Counter(words).most_common(20),columns=['Word', 'Frequency'])
-#     return most_common_df
-#
-#
-# def emoji_helper(selected_user,df):
-#     if selected_user != 'Overall':
-#         df = df[df['user'] == selected_user]
-#
-#     emojis = []
-#     for message in df['message']:
-#         emojis.extend([c for c in message if c in emoji.UNICODE_EMOJI['en']])
-#         emoji_df = pd.DataFrame(Counter(emojis).most_common(len(Counter(emojis))))
-#
-#     return emoji_df
-#
-# def monthly_timeline(selected_user,df):
-#
-#     if selected_user != 'Overall':
-#         df = df[df['user'] == selected_user]
-#
-#     timeline = df.groupby(['year', 'month_num', 'month']).count()['message'].reset_index()
-#
-#     time = []
-#     for i in range(timeline.shape[0]):
-#         time.append(timeline['month'][i] + "-" + str(timeline['year'][i]))
-#
-#     timeline['time'] = time
-#
-#     return timeline
-#
-# def daily_timeline(selected_user,df):
-#
-#     if selected_user != 'Overall':
-#         df = df[df['user'] == selected_user]
-#
-#     daily_timeline = df.groupby('only_date').count()['message'].reset_index()
-#
-#     return daily_timeline
 #
-# def week_activity_map(selected_user,df):
-#
-#     if selected_user != 'Overall':
-#         df = df[df['user'] == selected_user]
-#
-#     return df['day_name'].value_counts()
-#
-# def month_activity_map(selected_user,df):
-#
-#     if selected_user != 'Overall':
-#         df = df[df['user'] == selected_user]
-#
-#     return df['month'].value_counts()
-#
-# def activity_heatmap(selected_user,df):
-#
-#     if selected_user != 'Overall':
-#         df = df[df['user'] == selected_user]
-#
-#     user_heatmap = df.pivot_table(index='day_name', columns='period', values='message', aggfunc='count').fillna(0)
-#
-#     return user_heatmap
 #
+def emoji_helper(selected_user,df):
+    emoji_df = user_emoji_counts(selected_user, df)
+    # Same shape as before, emoji in column 0 and its count in column 1, most used first
+    return pd.DataFrame(list(emoji_df.items()))
+
+
+def user_emoji_counts(selected_user, df):
+    table = emoji_table(df)
+    if selected_user != 'Overall':
+        table = table[table['user'] == selected_user]
+    return table.groupby('emoji')['count'].sum().sort_values(ascending=False, kind='stable')
+
+
+def _char_class(chars):
+    # Regex character class of the code points, consecutive ones merged into ranges
+    ranges = []
+    for code in sorted(map(ord, chars)):
+        if ranges and code == ranges[-1][1] + 1:
+            ranges[-1][1] = code
+        else:
+            ranges.append([code, code])
+    return '[' + ''.join(re.escape(chr(first)) + ('-' + re.escape(chr(last)) if last > first else '')
+                         for first, last in ranges) + ']'
+
+
+# Single code point emojis of the emoji package, the characters emoji_helper always counted.
+# Regional indicators and skin tones only count as part of a flag or an emoji before them
+_EMOJI_CHARS = {
+    char for char in emoji.EMOJI_DATA
+    if len(char) == 1 and not ('\U0001f1e6' <= char <= '\U0001f1ff' or '\U0001f3fb' <= char <= '\U0001f3ff')
+}
+# Mostly typed as plain text marks, they only count in their emoji form ending in U+FE0F
+_TEXT_MARKS = {'\u00a9', '\u00ae', '\u2122'}
+_SKIN_TONE = '[\U0001f3fb-\U0001f3ff]'
+
+# Skin tones, the variation selector and tag sequences (subdivision flags) attach to the emoji
+# before them, ZWJ joins several emojis into one like 👨‍👩‍👧
+_EMOJI_FIRST = (f'(?:{_char_class(_EMOJI_CHARS - _TEXT_MARKS)}\ufe0f?{_SKIN_TONE}?|{_char_class(_TEXT_MARKS)}\ufe0f)'
+                '(?:[\U000e0020-\U000e007e]+\U000e007f)?')
+_EMOJI_JOINED = f'{_char_class(_EMOJI_CHARS)}\ufe0f?{_SKIN_TONE}?'
+EMOJI_PATTERN = re.compile(
+    '[\U0001f1e6-\U0001f1ff]{2}'  # flags are two regional indicators
+    '|[#*0-9]\ufe0f?\u20e3'  # keycaps
+    f'|{_EMOJI_FIRST}(?:\u200d{_EMOJI_JOINED})*'
+)
+
+
+def emoji_table(df):
+    """(user, emoji, count) for every emoji used in the chat, worked out once per frame."""
+    cache = frame_cache(df)
+    if 'emoji_table' in cache:
+        return cache['emoji_table']
+
+    emojis = df['message'].str.findall(EMOJI_PATTERN)
+    emojis.index = np.arange(df.shape[0])
+    emojis = emojis.explode().dropna()
+
+    table = pd.DataFrame({
+        'user': np.asarray(df['user'], dtype=object)[emojis.index.values],
+        'emoji': emojis.values.astype(str),
+    }).groupby(['user', 'emoji']).size().rename('count').reset_index()
+    cache['emoji_table'] = table
+    return table
+
+
+def activity_cube(df):
+    """Message counts per (user, day, hour), every timeline and heatmap is a roll-up of this."""
+    cache = frame_cache(df)
+    if 'activity_cube' in cache:
+        return cache['activity_cube']
+
+    dates = df['date']
+    cube = pd.DataFrame({
+        'user': df['user'].values,
+        'only_date': dates.dt.floor('D').values,
+        'hour': dates.dt.hour.values,
+    }).groupby(['user', 'only_date', 'hour'], observed=True, sort=False).size().rename('message').reset_index()
+    cube['hour'] = cube['hour'].astype('int8')
+    cache['activity_cube'] = cube
+    return cube
+
+
+def user_activity(selected_user, df):
+    cube = activity_cube(df)
+    if selected_user != 'Overall':
+        cube = cube[cube['user'] == selected_user]
+    return cube
+
+
+def monthly_timeline(selected_user,df):
+    cube = user_activity(selected_user, df)
+    dates = cube['only_date'].dt
+
+    timeline = cube.groupby([dates.year.rename('year'), dates.month.rename('month_num')])['message'].sum().reset_index()
+    timeline.insert(2, 'month', pd.to_datetime(dict(year=timeline['year'], month=timeline['month_num'], day=1)).dt.month_name())
+    timeline['time'] = timeline['month'] + "-" + timeline['year'].astype(str)
+
+    return timeline
+
+def daily_timeline(selected_user,df):
+    cube = user_activity(selected_user, df)
+
+    daily_timeline = cube.groupby('only_date')['message'].sum().reset_index()
+
+    return daily_timeline
+
+def week_activity_map(selected_user,df):
+    cube = user_activity(selected_user, df)
+
+    return _activity_counts(cube['message'], cube['only_date'].dt.day_name().rename('day_name'))
+
+def month_activity_map(selected_user,df):
+    cube = user_activity(selected_user, df)
+
+    return _activity_counts(cube['message'], cube['only_date'].dt.month_name().rename('month'))
+
+def _activity_counts(counts, labels):
+    # Same layout as value_counts on the message frame, busiest first
+    return counts.groupby(labels).sum().sort_values(ascending=False, kind='stable').rename('count')
+
+def activity_heatmap(selected_user,df):
+    cube = user_activity(selected_user, df)
+
+    user_heatmap = cube.pivot_table(
+        index=pd.Series(pd.Categorical.from_codes(cube['only_date'].dt.dayofweek.values, dtype=preprocessor.DAY_NAMES),
+                        index=cube.index, name='day_name'),
+        columns=pd.Series(pd.Categorical.from_codes(cube['hour'].values, dtype=preprocessor.PERIOD_LABELS),
+                          index=cube.index, name='period'),
+        values='message', aggfunc='sum', observed=True).fillna(0)
+
+    return user_heatmap
+
 # def analyze_sentiment(message):
 #     blob = TextBlob(message)
 #     sentiment_score = blob.sentiment.polarity
@@ -246,25 +415,26 @@ def create_wordcloud(selected_user,df):
 #     st.write(f"Average Message Length for {selected_participant}: {average_length:.2f}")
 #
 #
-# # Function for busiest hours analysis
-# def busiest_hours_analysis(df):
-#     busiest_hours = df['hour'].value_counts()
-#     st.bar_chart(busiest_hours)
 #
 #
-# # Function for message count by month
-# def message_count_by_month(selected_participant,df):
-#     filtered_df = df[df['user'] == selected_participant] if selected_participant != 'Overall' else df
-#     message_count_per_month = filtered_df.groupby(['year', 'month']).count()['message'].reset_index()
-#     st.dataframe(message_count_per_month)
+# Function for busiest hours analysis
+def busiest_hours_analysis(df):
+    cube = activity_cube(df)
+    busiest_hours = _activity_counts(cube['message'], cube['hour'])
+    st.bar_chart(busiest_hours)
+
+
+# Function for message count by month
+def message_count_by_month(selected_participant,df):
+    timeline = monthly_timeline(selected_participant, df)
+    message_count_per_month = timeline[['year', 'month', 'message']]
+    st.dataframe(message_count_per_month)
 #
 #
-# # Function for top emojis used
-# def top_emojis_used(selected_participant,df):
-#     filtered_df = df[df['user'] == selected_participant] if selected_participant != 'Overall' else df
-#     emojis = [c for message in filtered_df['message'] for c in message if c in emoji.UNICODE_EMOJI['en']]
-#     top_emojis = Counter(emojis).most_common()
-#     st.write(f"Top Emojis Used by {selected_participant}: {top_emojis}")
+# Function for top emojis used
+def top_emojis_used(selected_participant,df):
+    top_emojis = list(user_emoji_counts(selected_participant, df).items())
+    st.write(f"Top Emojis Used by {selected_participant}: {top_emojis}")
 #
 #
 # # Function for greeting and farewell analysis
@@ -311,214 +481,164 @@ def create_wordcloud(selected_user,df):
 #     stop_words = set(f.read().splitlines())
 #
 #
-# #Only highest Reply time user display
-# def longest_reply_user(df):
-#     # Ordinal encoders will encode each user with its own number
-#     user_encoder = OrdinalEncoder()
-#     df['User Code'] = user_encoder.fit_transform(df['user'].values.reshape(-1, 1))
-#
-#     # Find replies
-#     message_senders = df['User Code'].values
-#     sender_changed = (np.roll(message_senders, 1) - message_senders).reshape(1, -1)[0] != 0
-#     sender_changed[0] = False
-#     is_reply = sender_changed & ~df['user'].eq('group_notification')
-#
-#     df['Is Reply'] = is_reply
-#
-#     # Calculate times based on replies
-#     reply_times, indices = preprocessor.calculate_times_on_trues(df, 'Is Reply')
-#     reply_times_df_list = []
-#     reply_time_index = 0
-#     for i in range(0, len(df)):
-#         if i in indices:
-#             reply_times_df_list.append(reply_times[reply_time_index].astype("timedelta64[m]").astype("float"))
-#             reply_time_index += 1
-#         else:
-#             reply_times_df_list.append(0)
-#
-#     df['Reply Time'] = reply_times_df_list
-#
-#     # Calculate the maximum reply time for each user
-#     max_reply_times = df.groupby('user')['Reply Time'].max()
-#
-#     # Find the user with the longest reply time
-#     max_reply_user = max_reply_times.idxmax()
-#     max_reply_time = max_reply_times.max()
-#     return max_reply_user, max_reply_time
-#
-#
-# #additional info about reply
-#
-# def longest_reply_user2(df):
-#
-#     # Filter out messages containing the specified strings
-#     omitted_strings = ["image omitted", "media omitted", "video omitted"]
-#     df = df[~df['message'].str.lower().str.contains('|'.join(omitted_strings))]
-#
-#     # Ordinal encoders will encode each user with its own number
-#     user_encoder = OrdinalEncoder()
-#     df['User Code'] = user_encoder.fit_transform(df['user'].values.reshape(-1, 1))
-#
-#     # Find replies
-#     message_senders = df['User Code'].values
-#     sender_changed = (np.roll(message_senders, 1) - message_senders).reshape(1, -1)[0] != 0
-#     sender_changed[0] = False
-#     is_reply = sender_changed & ~df['user'].eq('group_notification')
-#
-#     df['Is Reply'] = is_reply
-#
-#     # Calculate times based on replies
-#     reply_times, indices = preprocessor.calculate_times_on_trues(df, 'Is Reply')
-#     reply_times_df_list = []
-#     reply_time_index = 0
-#     for i in range(0, len(df)):
-#         if i in indices:
-#             reply_times_df_list.append(reply_times[reply_time_index].astype("timedelta64[m]").astype("float"))
-#             reply_time_index += 1
-#         else:
-#             reply_times_df_list.append(0)
-#
-#     df['Reply Time'] = reply_times_df_list
-#
-#     # Calculate the maximum reply time for each user
-#     max_reply_times = df.groupby('user')['Reply Time'].max()
-#
-#     # Find the user with the longest reply time
-#     max_reply_user = max_reply_times.idxmax()
-#     max_reply_time_minutes = max_reply_times.max()  # Max reply time in minutes
-#
-#     # Find the message to which the user replied the most late
-#     max_reply_message_index = df[df['Reply Time'] == max_reply_time_minutes].index[0]
-#     max_reply_message = df.loc[max_reply_message_index, 'message']
-#
-#     reply = df.shift(1).loc[max_reply_message_index, 'message']
-#
-#     return max_reply_user, max_reply_time_minutes, max_reply_message,reply
-#
-#
-#
-# def top5_late_replies(df):
-#     # Filter out messages containing the specified strings
-#     omitted_strings = ["image omitted", "media omitted", "video omitted"]
-#     df = df[~df['message'].str.lower().str.contains('|'.join(omitted_strings))]
-#
-#     # Ordinal encoders will encode each user with its own number
-#     user_encoder = OrdinalEncoder()
-#     df['User Code'] = user_encoder.fit_transform(df['user'].values.reshape(-1, 1))
-#
-#     # Find replies
-#     message_senders = df['User Code'].values
-#     sender_changed = (np.roll(message_senders, 1) - message_senders).reshape(1, -1)[0] != 0
-#     sender_changed[0] = False
-#     is_reply = sender_changed & ~df['user'].eq('group_notification')
-#
-#     df['Is Reply'] = is_reply
-#
-#     # Calculate times based on replies
-#     reply_times, indices = preprocessor.calculate_times_on_trues(df, 'Is Reply')
-#     reply_times_df_list = []
-#     reply_time_index = 0
-#     for i in range(0, len(df)):
-#         if i in indices:
-#             reply_times_df_list.append(reply_times[reply_time_index].astype("timedelta64[m]").astype("float"))
-#             reply_time_index += 1
-#         else:
-#             reply_times_df_list.append(0)
-#
-#     df['Reply Time'] = reply_times_df_list
-#
-#     # Calculate the maximum reply time for each user
-#     max_reply_times = df.groupby('user')['Reply Time'].max()
-#
-#     # Find the top 5 users with the longest reply times
-#     top_5_users = max_reply_times.nlargest(5)
-#
-#     # Initialize lists to store results
-#     users = []
-#     reply_times = []
-#     max_reply_messages = []
-#     replies = []
-#
-#     # Iterate over the top 5 users
-#     for user, max_reply_time in top_5_users.items():
-#         # Find the message to which the user replied the most late
-#         max_reply_message_index = df[df['Reply Time'] == max_reply_time].index[0]
-#         max_reply_message = df.loc[max_reply_message_index, 'message']
-#
-#         # Get the reply to the max reply message
-#         reply = df.shift(1).loc[max_reply_message_index, 'message']
-#
-#         # Append user, max reply time, max reply message, and reply to lists
-#         users.append(user)
-#         reply_times.append(max_reply_time)
-#         max_reply_messages.append(max_reply_message)
-#         replies.append(reply)
-#
-#     return users, reply_times, max_reply_messages, replies
-#
-#
-# def top_texts_late_replies(df):
-#     # Filter out messages containing the specified strings
-#     omitted_strings = ["image omitted", "media omitted", "video omitted"]
-#     df = df[~df['message'].str.lower().str.contains('|'.join(omitted_strings))]
-#
-#     # Ordinal encoders will encode each user with its own number
-#     user_encoder = OrdinalEncoder()
-#     df['User Code'] = user_encoder.fit_transform(df['user'].values.reshape(-1, 1))
-#
-#     # Find replies
-#     message_senders = df['User Code'].values
-#     sender_changed = (np.roll(message_senders, 1) - message_senders).reshape(1, -1)[0] != 0
-#     sender_changed[0] = False
-#     is_reply = sender_changed & ~df['user'].eq('group_notification')
-#
-#     df['Is Reply'] = is_reply
-#
-#     # Calculate times based on replies
-#     reply_times, indices = preprocessor.calculate_times_on_trues(df, 'Is Reply')
-#     reply_times_df_list = []
-#     reply_time_index = 0
-#     for i in range(0, len(df)):
-#         if i in indices:
-#             reply_times_df_list.append(reply_times[reply_time_index].astype("timedelta64[m]").astype("float"))
-#             reply_time_index += 1
-#         else:
-#             reply_times_df_list.append(0)
-#
-#     df['Reply Time'] = reply_times_df_list
-#
-#     # Filter out texts with reply time greater than 1 day
-#     df = df[df['Reply Time'] > (48 * 60)]  # 1 day in minutes
-#
-#     # Find the top 5 users with the longest reply times
-#     top_5_users = df.groupby('user')['Reply Time'].max().nlargest(5)
-#
-#     # Initialize lists to store results
-#     users = []
-#     reply_times = []
-#     max_reply_messages = []
-#     replies = []
-#
-#     # Iterate over the top 5 users
-#     for user, max_reply_time in top_5_users.items():
-#         # Find the message to which the user replied the most late
-#         max_reply_message_index = df[df['Reply Time'] == max_reply_time].index[0]
-#         max_reply_message = df.loc[max_reply_message_index, 'message']
-#
-#         # Get the reply to the max reply message
-#         reply = df.shift(1).loc[max_reply_message_index, 'message']
-#
-#         # Append user, max reply time, max reply message, and reply to lists
-#         users.append(user)
-#         reply_times.append(max_reply_time)
-#         max_reply_messages.append(max_reply_message)
-#         replies.append(reply)
-#
-#     return users, reply_times, max_reply_messages, replies
-#
-#
 #
 #
+#Only highest Reply time user display
+def longest_reply_user(df):
+    users, reply_times, _, _ = late_reply_leaders(df, k=1, skip_media=False)
+    # Find the user with the longest reply time
+    return users[0], reply_times[0]
+
+
+#additional info about reply
+
+def longest_reply_user2(df):
+    users, reply_times, max_reply_messages, replies = late_reply_leaders(df, k=1)
+    return users[0], reply_times[0], max_reply_messages[0], replies[0]
+
+
+def top5_late_replies(df):
+    return late_reply_leaders(df, k=5)
+
+
+def top_texts_late_replies(df):
+    # Only texts with a reply time greater than 2 days, each user's slowest one
+    slowest = late_replies_topk(df, k=1, min_reply_time=48 * 60)
+
+    # Find the top 5 users with the longest reply times
+    top_5_users = sorted(slowest, key=lambda user: (-slowest[user][0][0], user))[:5]
+
+    reply_times = [slowest[user][0][0] for user in top_5_users]
+    max_reply_messages = [slowest[user][0][1] for user in top_5_users]
+    replies = [slowest[user][0][2] for user in top_5_users]
+    return top_5_users, reply_times, max_reply_messages, replies
+
+
+def late_replies_topk(frames, k=5, min_reply_time=48 * 60):
+    """Each user's k slowest replies over `min_reply_time` minutes, slowest first.
+
+    `frames` is one preprocessed frame or the chunks of preprocessor.preprocess_chunks() in
+    chat order. Only k (reply time, reply, answered message) entries per user are kept while
+    scanning, so memory doesn't grow with the chat.
+    """
+    if isinstance(frames, pd.DataFrame):
+        frames = [frames]
+
+    heaps = {}
+    # user, date and text of the last text message of the previous chunk
+    previous = None
+    position = 0
+
+    for df in frames:
+        # Only the three columns needed are taken through the mask, not the whole frame
+        text = ~media_omitted_mask(df)
+        if not text.any():
+            continue
+
+        users = np.asarray(df['user'].values[text], dtype=object)
+        dates = df['date'].values[text]
+        messages = df['message'].values[text]
+
+        is_reply, reply_time = find_reply_times(users, dates, previous[:2] if previous else None)
+
+        # Only the few replies over the threshold ever leave NumPy
+        for i in np.flatnonzero(is_reply & (reply_time > min_reply_time)):
+            answered = messages[i - 1] if i else previous[2]
+            # Earlier replies win ties, the position also keeps strings out of the comparison
+            entry = (reply_time[i], -(position + i), messages[i], answered)
+            heap = heaps.setdefault(users[i], [])
+            if len(heap) < k:
+                heapq.heappush(heap, entry)
+            else:
+                heapq.heappushpop(heap, entry)
+
+        position += len(users)
+        previous = (users[-1], dates[-1], messages[-1])
+
+    return {
+        user: [(reply_time, message, answered) for reply_time, _, message, answered in sorted(heap, reverse=True)]
+        for user, heap in heaps.items()
+    }
+
+
+def late_reply_leaders(df, k=5, min_reply_time=None, skip_media=True):
+    """The k users with the longest reply, with that reply and the message it answered."""
+    full_analysis = reply_analysis(df, skip_media)
+    analysis = full_analysis
+    if min_reply_time is not None:
+        analysis = analysis[analysis['reply_time'] > min_reply_time]
+
+    # Each user's slowest reply, then the k slowest of those
+    slowest = analysis.loc[analysis.groupby('user', observed=True)['reply_time'].idxmax()]
+    slowest = slowest.nlargest(k, 'reply_time')
+
+    messages = full_analysis['message'].values
+    replies = [messages[previous] if previous >= 0 else None for previous in slowest['previous']]
+    return list(slowest['user']), list(slowest['reply_time']), list(slowest['message']), replies
+
+
+# Messages containing these are media placeholders
+OMITTED_STRINGS = ["image omitted", "media omitted", "video omitted"]
+
+
+def media_omitted_mask(df):
+    # Matched case-insensitively in place, no lower-cased copy of every message
+    cache = frame_cache(df)
+    if 'media_omitted' not in cache:
+        cache['media_omitted'] = df['message'].str.contains('|'.join(OMITTED_STRINGS), case=False).values
+    return cache['media_omitted']
+
+
+def reply_analysis(df, skip_media=True):
+    """Reply time in minutes and the position of the previous message for every message.
+
+    Worked out once per frame for the late reply leaderboards, with skip_media the media
+    placeholders are dropped first so a reply is timed against the previous text.
+    """
+    cache = frame_cache(df)
+    key = ('reply_analysis', skip_media)
+    if key in cache:
+        return cache[key]
+
+    users = df['user'].values
+    dates = df['date'].values
+    messages = df['message'].values
+    if skip_media:
+        text = ~media_omitted_mask(df)
+        users, dates, messages = users[text], dates[text], messages[text]
+
+    _, reply_time = find_reply_times(np.asarray(users, dtype=object), dates)
+
+    analysis = pd.DataFrame({
+        'user': users,
+        'message': messages,
+        'reply_time': reply_time,
+        'previous': np.arange(len(users)) - 1,
+    })
+    cache[key] = analysis
+    return analysis
+
+
+def find_reply_times(users, dates, previous=None):
+    """Reply flags and reply times in minutes (0 on other messages) of consecutive messages.
+
+    A reply is a message from someone else than the sender of the message before it,
+    `previous` is the (user, date) of the message right before the first one, if any.
+    """
+    if len(users) == 0:
+        return np.zeros(0, dtype=bool), np.zeros(0)
+
+    previous_users = np.empty(len(users), dtype=object)
+    previous_users[1:] = users[:-1]
+    previous_dates = np.empty(len(dates), dtype=dates.dtype)
+    previous_dates[1:] = dates[:-1]
+    previous_users[0], previous_dates[0] = previous if previous is not None else (users[0], dates[0])
+
+    is_reply = (users != previous_users) & (users != 'group_notification')
+    gaps = (dates - previous_dates).astype("timedelta64[m]").astype("float")
+    return is_reply, np.where(is_reply, gaps, 0)
+
+
 # # shows everyone's reply time and also plots graph
 # def show_average_reply_time(df):
 #     # Group by user and calculate the average reply time
@@ -541,22 +661,23 @@ def create_wordcloud(selected_user,df):
 #     st.plotly_chart(fig)
 #
 #
-#
-# def _create_wide_area_fig(df : pd.DataFrame, legend : bool = True):
-#     fig, ax = plt.subplots(figsize=(12,5))
-#     df.plot(
-#         alpha=0.6,
-#         cmap=plt.get_cmap('viridis'),
-#         ax=ax,
-#         stacked=True
-#     )
-#     ax.patch.set_alpha(0.0)
-#     fig.patch.set_alpha(0.0)
-#     if legend:
-#         ax.legend(df['user'])
-#     return fig
-#
-#
+
+
+def _create_wide_area_fig(df : pd.DataFrame, legend : bool = True):
+    fig, ax = plt.subplots(figsize=(12,5))
+    df.plot(
+        alpha=0.6,
+        cmap=plt.get_cmap('viridis'),
+        ax=ax,
+        stacked=True
+    )
+    ax.patch.set_alpha(0.0)
+    fig.patch.set_alpha(0.0)
+    if legend:
+        ax.legend(df.columns)
+    return fig
+
+
 # def create_narrow_pie_fig(df : pd.DataFrame):
 #     narrow_figsize = (6, 5)
 #     cmap = plt.get_cmap('viridis')
@@ -620,328 +741,292 @@ def create_wordcloud(selected_user,df):
 #
 #     return max_idle_date,max_idle_time
 #
-# def median_delay_btwn_convo(df):
-#
-#     df['date'] = pd.to_datetime(df['date'])
-#
-#     # Calculate reply delay within each conversation
-#     df['Reply Delay'] = df.groupby('Conv code')['date'].diff().dt.total_seconds() / 60.0  # Convert to minutes
-#
-#     # Group by conversation and calculate median reply delay
-#     median_delay_per_conversation = df.groupby('Conv code')['Reply Delay'].median()
-#
-#     # Calculate overall median delay across all conversations
-#     overall_median_delay = median_delay_per_conversation.median()
-#
-#     print(f"Median Delay Between Conversations: {overall_median_delay:.2f} minutes")
-#
-# def median_delay_between_conversations(user,df):
-#     df['date'] = pd.to_datetime(df['date'])
-#     # Filter DataFrame to include only messages sent by the specified user
-#     user_messages = df[df['user'] == user]
-#
-#     # Calculate reply delay within each conversation for the user
-#     user_messages['Reply Delay'] = user_messages.groupby('Conv code')[
-#                                        'date'].diff().dt.total_seconds() / 60.0  # Convert to minutes
-#
-#     # Display the median reply delay for the user
-#     median_delay_per_user = user_messages['Reply Delay'].median()
-#
-#
-#     #THIS IS NOT WORKING ONLY MEDIAN DELAY SHOWING RIGHT
-#     # TODO: UPDATE THE AVERAGE DELAY BETWEEN REPLIES IN CONVERSATION
-#
-#     # # Compute average delay between conversations for the user
-#     # avg_delay_between_conversations = user_messages['Reply Delay'].mean()
-#
-#     return median_delay_per_user
-#
-#
-#
-# def double_text_counts(user_of_interest, df):
-#     # Store the original index of the DataFrame
-#     original_index = df.index
-#
-#     # Reset the index of the DataFrame
-#     df = df.reset_index(drop=True)
-#
-#     # Filter DataFrame to include only messages sent by the specified user
-#     user_messages = df[df['user'] == user_of_interest]
-#
-#     # Convert 'date' column to datetime if it's not already
-#     user_messages['date'] = pd.to_datetime(user_messages['date'])
-#
-#     # Sort DataFrame by date
-#     user_messages = user_messages.sort_values(by='date')
-#
-#     # Define the threshold for double texting (in minutes)
-#     threshold_minutes = 1440  # Adjust as needed
-#
-#     # Initialize double texting count
-#     double_texting_count = 0
-#
-#     # Calculate the time difference between consecutive messages for the user
-#     time_diff = user_messages['date'].diff().dt.total_seconds() / 60.0  # Convert to minutes
-#
-#     # Identify instances of double texting
-#     double_texting_indices = time_diff < threshold_minutes
-#
-#     # Count the number of double texting instances
-#     double_texting_count = sum(double_texting_indices)
-#
-#     # Restore the original index of the DataFrame
-#     user_messages.index = original_index[user_messages.index]
-#
-#     return double_texting_count
-#
-#
-# def response_activity(user,df):
-#     df['date'] = pd.to_datetime(df['date'])
-#     # Sort DataFrame by date
-#     df = df.sort_index()
-#
-#     # Initialize counts dictionary to store counts for each time interval
-#     time_intervals = [20, 40, 60, 80, 100, 120]
-#     counts = {interval: 0 for interval in time_intervals}
-#     counts['>120'] = 0
-#
-#     # Filter DataFrame to include only messages sent by the specified user
-#     user_messages = df[df['user'] == user]
-#
-#     # Iterate over each row in the filtered DataFrame
-#     for index, row in user_messages.iterrows():
-#         # Check if the message is a repl
-#         if row['Is reply']:
-#             print("Row columns: ")
-#             print(row,index)
-#             # Find the index of the previous message sent by the same user
-#             previous_index = index - 1
-#             while previous_index >= 0 and df.loc[previous_index, 'user'] != user:
-#                 previous_index -= 1
-#
-#             # If a previous message is found, calculate the time difference
-#             if previous_index >= 0:
-#                 reply_time = (row['date'] - df.loc[previous_index, 'date']).total_seconds()
-#                 # Iterate over time intervals and update counts accordingly
-#                 for interval in time_intervals:
-#                     if reply_time <= interval:
-#                         counts[interval] += 1
-#                         break
-#                 else:
-#                     counts['>120'] += 1
-#
-#     # Return the counts
-#     return counts
-#
-#
-#
-# import nltk
-# from nltk.sentiment.vader import SentimentIntensityAnalyzer
-# import plotly.graph_objects as go
-#
-# def analyze_and_plot_sentiment(selected_users,df):
-#     nltk.download('vader_lexicon')
-#     # Filter messages based on selected users
-#     if selected_users  == 'Overall':
-#         selected_df = df['message']  # Consider the whole message column if 'Overall' is selected
-#     else:
-#         if isinstance(selected_users, str):
-#             selected_users = [selected_users]  # Convert to list if only one user is selected
-#         selected_df = df[df['user'].isin(selected_users)]['message']
-#
-#
-#     # Initialize the sentiment analyzer outside the function
-#     sid = SentimentIntensityAnalyzer()
-#
-#     # Initialize dictionaries to store positive and negative scores for each word
-#     positive_word_sentiments = {}
-#     negative_word_sentiments = {}
-#
-#     # Tokenize the conversation into words
-#     words = nltk.word_tokenize(' '.join(selected_df))
-#
-#     # Iterate over each word in the conversation
-#     for word in words:
-#         # Get sentiment score for the word
-#         sentiment_score = sid.polarity_scores(word)['compound']
-#
-#         # Update word_sentiments dictionary based on sentiment score
-#         if sentiment_score > 0:
-#             positive_word_sentiments[word] = positive_word_sentiments.get(word, 0) + sentiment_score
-#         elif sentiment_score < 0:
-#             negative_word_sentiments[word] = negative_word_sentiments.get(word, 0) + sentiment_score
-#
-#     # Sort dictionaries by their values (sentiment scores)
-#     sorted_positive_words = sorted(positive_word_sentiments.items(), key=lambda x: x[1], reverse=True)
-#     sorted_negative_words = sorted(negative_word_sentiments.items(), key=lambda x: x[1], reverse=True)
-#
-#     # Extract words and scores for plotting
-#     positive_words, positive_scores = zip(*sorted_positive_words)
-#     negative_words, negative_scores = zip(*sorted_negative_words)
-#
-#     # Create hover text for positive sentiment scores
-#     positive_hover_text = [
-#         f'Word: {word}<br>Sentiment Score: {score}<br>Frequency: {positive_word_sentiments[word]}<br>Frequency: {words.count(word)}'
-#         for
-#         word, score in zip(positive_words, positive_scores)]
-#
-#     # Create hover text for negative sentiment scores
-#     negative_hover_text = [
-#         f'Word: {word}<br>Sentiment Score: {score}<br>Frequency: {negative_word_sentiments[word]}<br>Frequency: {words.count(word)}'
-#         for
-#         word, score in zip(negative_words, negative_scores)]
-#
-#     # Create histogram for positive sentiment scores
-#     positive_trace = go.Bar(
-#         x=positive_words,
-#         y=positive_scores,
-#         marker_color='blue',
-#         name='Positive',
-#         hovertext=positive_hover_text
-#     )
-#
-#     # Create histogram for negative sentiment scores
-#     negative_trace = go.Bar(
-#         x=negative_words,
-#         y=negative_scores,
-#         marker_color='red',
-#         name='Negative',
-#         hovertext=negative_hover_text
-#     )
-#
-#     # Create layout for positive scores histogram
-#     positive_layout = go.Layout(
-#         title='Positive Sentiment Scores by Word',
-#         xaxis=dict(title='Words'),
-#         yaxis=dict(title='Sentiment Score')
-#     )
-#
-#     # Create layout for negative scores histogram
-#     negative_layout = go.Layout(
-#         title='Negative Sentiment Scores by Word',
-#         xaxis=dict(title='Words'),
-#         yaxis=dict(title='Sentiment Score', autorange="reversed")
-#     )
-#
-#     # Create figure for positive scores histogram
-#     positive_fig = go.Figure(data=[positive_trace], layout=positive_layout)
-#
-#     # Create figure for negative scores histogram
-#     negative_fig = go.Figure(data=[negative_trace], layout=negative_layout)
-#
-#
-#     return positive_fig, negative_fig
-#
-#
-#
-# def calculate_sentiment_percentage(selected_users, df):
-#     nltk.download('vader_lexicon')
-#
-#     # Filter messages based on selected users
-#     if selected_users == 'Overall':
-#         selected_df = df  # Consider the whole dataframe if 'Overall' is selected
-#     else:
-#         if isinstance(selected_users, str):
-#             selected_users = [selected_users]  # Convert to list if only one user is selected
-#         selected_df = df[df['user'].isin(selected_users)]
-#
-#     # Initialize the sentiment analyzer outside the function
-#     sid = SentimentIntensityAnalyzer()
-#
-#     # Initialize counters for positive and negative sentiment scores
-#     positive_count = 0
-#     negative_count = 0
-#
-#     # Dictionary to store positivity and negativity percentages for each user
-#     user_sentiment_percentages = {}
-#
-#     # Tokenize and analyze sentiment for each message
-#     for user, messages in selected_df.groupby('user')['message']:
-#         # Reset counters for each user
-#         positive_count = 0
-#         negative_count = 0
-#
-#         # Calculate sentiment scores for each message
-#         for message in messages:
-#             sentiment_score = sid.polarity_scores(message)['compound']
-#             if sentiment_score > 0:
-#                 positive_count += 1
-#             elif sentiment_score < 0:
-#                 negative_count += 1
-#
-#         # Calculate positivity and negativity percentages for the user
-#         total_messages = len(messages)
-#         positivity_percentage = (positive_count / total_messages) * 100
-#         negativity_percentage = (negative_count / total_messages) * 100
-#
-#         # Format percentages as strings with two decimal places and a percentage sign
-#         formatted_positivity = f"{positivity_percentage:.2f}%"
-#         formatted_negativity = f"{negativity_percentage:.2f}%"
-#
-#         # Store the percentages in the dictionary
-#         user_sentiment_percentages[user] = (formatted_positivity, formatted_negativity)
-#
-#     # Find the most positive and most negative users
-#     most_positive_user = max(user_sentiment_percentages, key=lambda x: user_sentiment_percentages[x][0])
-#     most_negative_user = min(user_sentiment_percentages, key=lambda x: user_sentiment_percentages[x][1])
-#
-#     return user_sentiment_percentages, most_positive_user, most_negative_user
-#
-#
-#
-# import pandas as pd
-# import numpy as np
-# import plotly.express as px
-#
-# import pandas as pd
-# import plotly.express as px
-# from nltk.sentiment.vader import SentimentIntensityAnalyzer
-#
-# import pandas as pd
-# import plotly.express as px
-# from nltk.sentiment.vader import SentimentIntensityAnalyzer
-#
-# def calculate_monthly_sentiment_trend(df):
-#     # Make a copy of the DataFrame to avoid modifying the original DataFrame
-#     df_copy = df.copy()
-#     nltk.download('vader_lexicon')
-#
-#     # Initialize the sentiment analyzer outside the function
-#     sid = SentimentIntensityAnalyzer()
-#
-#     # Tokenize and analyze sentiment for each message
-#     sentiment_scores = []
-#     for message in df_copy['message']:
-#         # Get sentiment score for the message
-#         sentiment_score = sid.polarity_scores(message)['compound']
-#         sentiment_scores.append(sentiment_score)
-#
-#     # Add sentiment scores to the copied DataFrame
-#     df_copy['sentiment_score'] = sentiment_scores
-#
-#     # Convert 'date' column to datetime if it's not already
-#     df_copy['date'] = pd.to_datetime(df_copy['date'])
-#
-#     # Group data by month and calculate positivity and negativity percentages
-#     df_copy['month'] = df_copy['date'].dt.to_period('M')
-#     monthly_sentiment = df_copy.groupby('month').agg(
-#         positivity_percentage=('sentiment_score', lambda x: (x > 0).mean() * 100),
-#         negativity_percentage=('sentiment_score', lambda x: (x < 0).mean() * 100)
-#     )
-#
-#     # Convert Period index to string for serialization
-#     monthly_sentiment.index = monthly_sentiment.index.astype(str)
-#
-#     # Plot the trend
-#     fig = px.line(monthly_sentiment, x=monthly_sentiment.index, y=['positivity_percentage', 'negativity_percentage'],
-#                   title='Monthly Sentiment Trend',
-#                   labels={'month': 'Month', 'value': 'Percentage', 'variable': 'Sentiment'},
-#                   color_discrete_map={'positivity_percentage': 'blue', 'negativity_percentage': 'red'})
-#     fig.update_xaxes(type='category')  # Ensure x-axis is treated as categorical
-#
-#     return fig
-#
-#
+def median_delay_btwn_convo(df):
+    # Gap to the previous message of the same conversation, whoever sent it
+    minutes = np.diff(df['date'].values) / np.timedelta64(1, 'm')
+    conv_codes = df['Conv code'].values
+    same_conv = conv_codes[1:] == conv_codes[:-1]
+
+    # Median inside every conversation, then the median over conversations
+    median_delay_per_conversation = pd.Series(minutes[same_conv]).groupby(conv_codes[1:][same_conv]).median()
+    overall_median_delay = median_delay_per_conversation.median()
+
+    print(f"Median Delay Between Conversations: {overall_median_delay:.2f} minutes")
+    return overall_median_delay
+
+def median_delay_between_conversations(user,df):
+    # Median minutes between the user's own messages inside a conversation
+    delays = reply_delay_table(df)
+    return delays.at[user, 'median delay'] if user in delays.index else np.nan
+
+
+
+def double_text_counts(user_of_interest, df):
+    delays = reply_delay_table(df)
+    return delays.at[user_of_interest, 'double texts'] if user_of_interest in delays.index else 0
+
+
+# Two messages of the same user less than this many minutes apart count as a double text
+DOUBLE_TEXT_MINUTES = 1440
+
+
+def reply_delay_table(df, double_text_minutes=DOUBLE_TEXT_MINUTES):
+    """Double texts and the median and mean minutes between own messages in a conversation, per user.
+
+    Computed for every user at once from the timestamps sorted by user then date, the
+    per-user functions above only look up their row.
+    """
+    cache = frame_cache(df)
+    key = ('reply_delays', double_text_minutes)
+    if key in cache:
+        return cache[key]
+
+    users = df['user'].astype('category').cat
+    codes = users.codes.values
+    dates = df['date'].values
+    conv_codes = df['Conv code'].values
+
+    # Stable, so messages with the same timestamp keep their chat order
+    order = np.lexsort((dates, codes))
+    codes, dates, conv_codes = codes[order], dates[order], conv_codes[order]
+    minutes = np.diff(dates) / np.timedelta64(1, 'm')
+    same_user = codes[1:] == codes[:-1]
+    same_conv = same_user & (conv_codes[1:] == conv_codes[:-1])
+
+    double_texts = np.bincount(codes[1:][same_user & (minutes < double_text_minutes)],
+                               minlength=len(users.categories))
+    delays = pd.Series(minutes[same_conv]).groupby(codes[1:][same_conv]).agg(['median', 'mean'])
+
+    table = pd.DataFrame({'double texts': double_texts}, index=pd.Index(users.categories, name='user'))
+    table['median delay'] = delays['median'].reindex(range(len(table))).values
+    table['mean delay'] = delays['mean'].reindex(range(len(table))).values
+    cache[key] = table
+    return table
+
+
+def response_activity(user,df):
+    # Counts for each time interval, read off the table of all users
+    activity = response_activity_all(df)
+    if user not in activity.index:
+        return {interval: 0 for interval in RESPONSE_INTERVALS}
+    return activity.loc[user].to_dict()
+
+
+# Seconds since the user's own previous message, the last bucket is everything above 120
+RESPONSE_INTERVALS = [20, 40, 60, 80, 100, 120, '>120']
+
+
+def response_activity_all(df):
+    """How quickly every user's replies follow their own previous message, one row per user."""
+    cache = frame_cache(df)
+    if 'response_activity' in cache:
+        return cache['response_activity']
+
+    # Sort DataFrame by date
+    if not df.index.is_monotonic_increasing:
+        df = df.sort_index(kind='stable')
+
+    users = df['user'].values
+    dates = df['date']
+    # The previous message sent by the same user, whoever wrote in between
+    previous_dates = dates.groupby(users, observed=True).shift(1)
+    reply_seconds = (dates - previous_dates).dt.total_seconds()
+
+    replies = df['Is reply'].values & reply_seconds.notna().values
+    buckets = pd.cut(reply_seconds[replies], bins=[-np.inf, 20, 40, 60, 80, 100, 120, np.inf],
+                     labels=RESPONSE_INTERVALS)
+
+    activity = pd.crosstab(pd.Series(users[replies], name='user'), buckets.values).reindex(
+        columns=RESPONSE_INTERVALS, fill_value=0)
+    activity.columns.name = None
+    cache['response_activity'] = activity
+    return activity
+
+
+@lru_cache(maxsize=None)
+def sentiment_analyzer():
+    # Built once for the whole app instead of once per chart
+    return SentimentIntensityAnalyzer()
+
+
+@lru_cache(maxsize=2 ** 18)
+def message_sentiment(message):
+    # Chats repeat the same short messages ("ok", "haha", stickers) a lot, each one is scored once
+    return sentiment_analyzer().polarity_scores(message)['compound']
+
+
+# Below this many distinct messages starting worker processes costs more than it saves
+PARALLEL_SENTIMENT_MIN_MESSAGES = 20000
+
+
+def add_sentiment_scores(df, workers=1):
+    """Score every message with VADER once and keep it in df['sentiment_score'].
+
+    With workers > 1 large chats are split into shards scored across a process pool.
+    Only rows without a score are scored, like the new rows of an incrementally extended frame.
+    """
+    if 'sentiment_score' not in df.columns:
+        df['sentiment_score'] = np.nan
+    missing = df['sentiment_score'].isna().values
+    if missing.any():
+        codes, messages = pd.factorize(df['message'].values[missing])
+        scores = np.array(score_messages(messages, workers))
+        df.loc[missing, 'sentiment_score'] = scores[codes]
+    return df['sentiment_score']
+
+
+def score_messages(messages, workers=1):
+    if workers <= 1 or len(messages) < PARALLEL_SENTIMENT_MIN_MESSAGES:
+        return score_shard(messages)
+
+    # A few shards per worker keeps them busy when some shards are slower than others,
+    # executor.map hands the results back in shard order
+    shards = np.array_split(np.asarray(messages, dtype=object), workers * 4)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return [score for shard_scores in executor.map(score_shard, shards) for score in shard_scores]
+
+
+def score_shard(messages):
+    return [message_sentiment(message) for message in messages]
+
+
+def analyze_and_plot_sentiment(selected_users,df):
+    # Filter messages based on selected users
+    if selected_users  == 'Overall':
+        selected_df = df['message']  # Consider the whole message column if 'Overall' is selected
+    else:
+        if isinstance(selected_users, str):
+            selected_users = [selected_users]  # Convert to list if only one user is selected
+        selected_df = df[df['user'].isin(selected_users)]['message']
+
+
+    # Tokenize the conversation into words and count each distinct word once
+    word_counts = Counter(nltk.word_tokenize(' '.join(selected_df)))
+    vocabulary = word_sentiment_table(word_counts)
+
+    # Every occurrence of a word adds its score, sorted by that total like before
+    positive = vocabulary[vocabulary['score'] > 0].sort_values('total', ascending=False, kind='stable')
+    negative = vocabulary[vocabulary['score'] < 0].sort_values('total', ascending=False, kind='stable')
+
+    positive_words, positive_scores = positive.index, positive['total']
+    negative_words, negative_scores = negative.index, negative['total']
+
+    # Create hover text for positive sentiment scores
+    positive_hover_text = [
+        f'Word: {word}<br>Sentiment Score: {total}<br>Word Score: {score}<br>Frequency: {count}'
+        for word, count, score, total in positive.itertuples()]
+
+    # Create hover text for negative sentiment scores
+    negative_hover_text = [
+        f'Word: {word}<br>Sentiment Score: {total}<br>Word Score: {score}<br>Frequency: {count}'
+        for word, count, score, total in negative.itertuples()]
+
+    # Create histogram for positive sentiment scores
+    positive_trace = go.Bar(
+        x=positive_words,
+        y=positive_scores,
+        marker_color='blue',
+        name='Positive',
+        hovertext=positive_hover_text
+    )
+
+    # Create histogram for negative sentiment scores
+    negative_trace = go.Bar(
+        x=negative_words,
+        y=negative_scores,
+        marker_color='red',
+        name='Negative',
+        hovertext=negative_hover_text
+    )
+
+    # Create layout for positive scores histogram
+    positive_layout = go.Layout(
+        title='Positive Sentiment Scores by Word',
+        xaxis=dict(title='Words'),
+        yaxis=dict(title='Sentiment Score')
+    )
+
+    # Create layout for negative scores histogram
+    negative_layout = go.Layout(
+        title='Negative Sentiment Scores by Word',
+        xaxis=dict(title='Words'),
+        yaxis=dict(title='Sentiment Score', autorange="reversed")
+    )
+
+    # Create figure for positive scores histogram
+    positive_fig = go.Figure(data=[positive_trace], layout=positive_layout)
+
+    # Create figure for negative scores histogram
+    negative_fig = go.Figure(data=[negative_trace], layout=negative_layout)
+
+
+    return positive_fig, negative_fig
+
+
+
+def word_sentiment_table(word_counts):
+    """One row per distinct word: how often it was used, its VADER score and score x count."""
+    vocabulary = pd.DataFrame({'count': pd.Series(word_counts, dtype='int64')})
+    vocabulary['score'] = [message_sentiment(word) for word in vocabulary.index]
+    vocabulary['total'] = vocabulary['score'] * vocabulary['count']
+    return vocabulary
+
+
+def calculate_sentiment_percentage(selected_users, df):
+    scores = add_sentiment_scores(df)
+    users = df['user']
+
+    # Filter messages based on selected users
+    if selected_users != 'Overall':
+        if isinstance(selected_users, str):
+            selected_users = [selected_users]  # Convert to list if only one user is selected
+        selected = df['user'].isin(selected_users)
+        scores = scores[selected]
+        users = users[selected]
+
+    # Positivity and negativity percentages of every user from the stored scores
+    percentages = pd.DataFrame({
+        'positive': scores.values > 0,
+        'negative': scores.values < 0,
+    }).groupby(users.values, observed=True).mean() * 100
+
+    # Format percentages as strings with two decimal places and a percentage sign
+    user_sentiment_percentages = {
+        user: (f"{positive:.2f}%", f"{negative:.2f}%")
+        for user, positive, negative in percentages.itertuples()
+    }
+
+    # Find the most positive and most negative users
+    most_positive_user = percentages['positive'].idxmax()
+    most_negative_user = percentages['negative'].idxmax()
+
+    return user_sentiment_percentages, most_positive_user, most_negative_user
+
+
+def calculate_monthly_sentiment_trend(df):
+    scores = add_sentiment_scores(df)
+
+    # Group data by month and calculate positivity and negativity percentages
+    months = df['date'].dt.to_period('M').values
+    monthly_sentiment = pd.DataFrame({
+        'positivity_percentage': (scores.values > 0) * 100.0,
+        'negativity_percentage': (scores.values < 0) * 100.0,
+    }).groupby(months).mean()
+    monthly_sentiment.index.name = 'month'
+
+    # Convert Period index to string for serialization
+    monthly_sentiment.index = monthly_sentiment.index.astype(str)
+
+    # Plot the trend
+    fig = px.line(monthly_sentiment, x=monthly_sentiment.index, y=['positivity_percentage', 'negativity_percentage'],
+                  title='Monthly Sentiment Trend',
+                  labels={'month': 'Month', 'value': 'Percentage', 'variable': 'Sentiment'},
+                  color_discrete_map={'positivity_percentage': 'blue', 'negativity_percentage': 'red'})
+    fig.update_xaxes(type='category')  # Ensure x-axis is treated as categorical
+
+    return fig
+
+
 # import pandas as pd
 # import plotly.express as px
 # import nltk
@@ -1036,26 +1121,35 @@ def create_wordcloud(selected_user,df):
 # #
 #
 # #
-#
-# def create_messages_per_week_graph(df: pd.DataFrame):
-#     # Convert 'Date' column to datetime if it's not already
-#     df['date'] = pd.to_datetime(df['date'])
-#
-#     # Makes the first graph
-#     date_df = df.groupby(df.index)[df['user']].sum().resample('W').sum()
-#     fig = _create_wide_area_fig(date_df)
-#
-#     max_message_count = date_df[df['user']].sum(axis=1).max()
-#     max_message_count_date = date_df.index[date_df[df['user']].sum(axis=1).argmax()]
-#     return fig, max_message_count, max_message_count_date
-#
-# def create_average_wpm_graph( df : pd.DataFrame):
-#     other_y_columns = [f"{subject}_mlength" for subject in df['user'].unique()]
-#     date_avg_df = df[other_y_columns].resample('W').mean()
-#     fig = _create_wide_area_fig(date_avg_df)
-#     return fig
-#
-#
+
+
+def _weekly_user_table(values : pd.Series, df : pd.DataFrame, aggfunc : str):
+    # Group on the integer user codes, then put the user names back as column labels
+    user_codes = df['user'].cat.codes.values
+    weekly = values.groupby([pd.Grouper(freq='W'), user_codes]).agg(aggfunc).unstack(fill_value=0)
+    weekly = weekly.asfreq('W', fill_value=0)
+    weekly.columns = df['user'].cat.categories[weekly.columns]
+    return weekly
+
+
+def create_messages_per_week_graph(df: pd.DataFrame):
+    # Makes the first graph
+    date_df = _weekly_user_table(df['Message Length'], df, 'size')
+    fig = _create_wide_area_fig(date_df)
+
+    weekly_totals = date_df.sum(axis=1)
+    max_message_count = weekly_totals.max()
+    max_message_count_date = date_df.index[weekly_totals.argmax()]
+    return fig, max_message_count, max_message_count_date
+
+def create_average_wpm_graph( df : pd.DataFrame):
+    # Words each user wrote in a week, averaged over every message sent that week
+    weekly_words = _weekly_user_table(df['Message Length'], df, 'sum')
+    date_avg_df = weekly_words.div(df['Message Length'].resample('W').size(), axis=0)
+    fig = _create_wide_area_fig(date_avg_df)
+    return fig
+
+
 # from langchain_experimental.agents.agent_toolkits import create_csv_agent
 # from langchain_openai import ChatOpenAI
 #
@@ -1,244 +1,470 @@
+import hashlib
+import io
+import os
 import re
+from collections import OrderedDict
+from datetime import datetime
+from itertools import islice
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from dateutil.parser import parse
 from sklearn.preprocessing import OrdinalEncoder
 
 
 ##THIS PROCESSING OLNY SUPPORTS ANDROID FORMAT IN AM/PM
 
-# def preprocess(data):
-#     pattern = r'\d{1,2}/\d{1,2}/\d{2,4},\s\d{1,2}:\d{2}\s(?:AM|PM|-\s)'
-#     messages = re.split(pattern, data)[1:]
-#     dates = re.findall(pattern, data)
-#
-#     df = pd.DataFrame({'user_message': messages, 'message_date': dates})
-#     df['message_date'] = df['message_date'].apply(lambda x: x.strip('- '))
-#
-#     # Parse the dates using dateutil.parser.parse
-#     df['date'] = df['message_date'].apply(lambda x: parse(x, fuzzy=True))
-#
-#     users = []
-#     messages = []
-#     for message in df['user_message']:
-#         entry = re.split('([\w\W]+?):\s', message)
-#         if entry[1:]:  # user name
-#             users.append(entry[1])
-#             messages.append(" ".join(entry[2:]))
-#         else:
-#             users.append('group_notification')
-#             messages.append(entry[0])
-#
-#     df['user'] = users
-#     df['message'] = messages
-#     df.drop(columns=['user_message', 'message_date'], inplace=True)
-#
-#     df['only_date'] = df['date'].dt.date
-#     df['year'] = df['date'].dt.year
-#     df['month_num'] = df['date'].dt.month
-#     df['month'] = df['date'].dt.month_name()
-#     df['day'] = df['date'].dt.day
-#     df['day_name'] = df['date'].dt.day_name()
-#     df['hour'] = df['date'].dt.hour
-#     df['minute'] = df['date'].dt.minute
-#
-#     period = []
-#     for hour in df[['day_name', 'hour']]['hour']:
-#         if hour == 23:
-#             period.append(str(hour) + "-" + str('00'))
-#         elif hour == 0:
-#             period.append(str('00') + "-" + str(hour + 1))
-#         else:
-#             period.append(str(hour) + "-" + str(hour + 1))
-#
-#     df['period'] = period
-#
-#     return df
-
-
-#THIS ONE WORKS WELL WITH BOTH ANDROID AND IOS FORMAT
-
-def preprocess(data):
-    # Check if the format is Android [MM/DD/YYYY, HH:MM - ]
-    android_pattern = r'\d{1,2}/\d{1,2}/\d{2,4},\s\d{1,2}:\d{2}\s(?:AM|PM|-\s)'
-    if re.search(android_pattern, data):
-        pattern = android_pattern
-        messages = re.split(pattern, data)[1:]
-        dates = re.findall(pattern, data)
-
-        df = pd.DataFrame({'user_message': messages, 'message_date': dates})
-        df['message_date'] = df['message_date'].apply(lambda x: x.strip('- '))
-
-    # Check if the format is iOS [MM/DD/YY, HH:MM:SS AM/PM]
-    elif re.search(r'\[\d{1,2}/\d{1,2}/\d{2,4},\s\d{1,2}:\d{2}:\d{2}\s(?:AM|PM)\]', data):
-        pattern = r'\[\d{1,2}/\d{1,2}/\d{2,4},\s\d{1,2}:\d{2}:\d{2}\s(?:AM|PM)\]'
-        messages = re.split(pattern, data)[1:]
-        dates = re.findall(pattern, data)
-
-        df = pd.DataFrame({'user_message': messages, 'message_date': dates})
-        df['message_date'] = df['message_date'].apply(lambda x: re.sub(r'[\[\]]', '', x))
+# A message starts with its timestamp, Android: "12/31/23, 10:15 PM - " and iOS: "[12/31/23, 10:15:30 PM] "
+MESSAGE_HEADER = re.compile(
+    r'\u200e?(?:(?P<android>\d{1,2}/\d{1,2}/\d{2,4},\s\d{1,2}:\d{2}(?:\s(?:AM|PM))?)\s-\s'
+    r'|\[(?P<ios>\d{1,2}/\d{1,2}/\d{2,4},\s\d{1,2}:\d{2}:\d{2}\s(?:AM|PM))\]\s)'
+)
+MESSAGE_AUTHOR = re.compile(r'([\w\W]+?):\s')
+MESSAGE_COLUMNS = ['message_date', 'user', 'message']
 
+
+def read_messages(lines):
+    """Yield (message_date, user, message) for every message of an export.
+
+    Works on any iterable of lines (an open file, a list, a StringIO), lines that
+    don't start with a timestamp belong to the message above them.
+    """
+    message_date = None
+    body = []
+
+    for line in lines:
+        header = MESSAGE_HEADER.match(line)
+        if header is None:
+            if message_date is not None:
+                body.append(line)
+            continue
+
+        if message_date is not None:
+            yield split_author(message_date, ''.join(body))
+        message_date = header.group('android') or header.group('ios')
+        body = [line[header.end():]]
+
+    if message_date is not None:
+        yield split_author(message_date, ''.join(body))
+
+
+def split_author(message_date, body):
+    author = MESSAGE_AUTHOR.match(body)
+    if author is None:
+        return message_date, 'group_notification', body
+    return message_date, author.group(1), body[author.end():]
+
+
+def preprocess(data, inter_conversation_threshold_time: int = 60, csv_path: str = None):
+    # Accept the whole export as a string or anything that yields its lines
+    lines = io.StringIO(data) if isinstance(data, str) else data
+    df = pd.DataFrame(read_messages(lines), columns=MESSAGE_COLUMNS)
+    if df.empty:
+        raise ValueError("Unsupported data format")
+
+    df = add_derived_columns(df, inter_conversation_threshold_time=inter_conversation_threshold_time)
+
+    if csv_path is not None:
+        df.to_csv(csv_path, index=False)
+
+    return df
+
+
+def preprocess_incremental(data, stored: pd.DataFrame, inter_conversation_threshold_time: int = 60):
+    """Extend a frame preprocessed from an older export of the same chat with a newer export.
+
+    Only the messages after the already ingested part are parsed, their derived columns
+    continue from the last stored message. Pass the threshold `stored` was built with.
+    When the stored messages can't be found in the new export it is preprocessed from scratch.
+    """
+    lines = io.StringIO(data) if isinstance(data, str) else data
+    records = list(read_messages(lines))
+    if not records:
+        raise ValueError("Unsupported data format")
+
+    boundary = find_ingested_prefix(records, stored)
+    if boundary is None:
+        df = pd.DataFrame(records, columns=MESSAGE_COLUMNS)
+        return add_derived_columns(df, inter_conversation_threshold_time=inter_conversation_threshold_time)
+    if boundary == len(records):
+        return stored
+
+    previous = {
+        'date': stored.index.values[-1],
+        'user': stored['user'].iloc[-1],
+        'conv_code': stored['Conv code'].iloc[-1],
+    }
+    tail = pd.DataFrame(records[boundary:], columns=MESSAGE_COLUMNS)
+    tail = add_derived_columns(tail, previous, participant_columns=False,
+                               inter_conversation_threshold_time=inter_conversation_threshold_time)
+
+    # Both parts need the same categories, otherwise concat falls back to plain strings
+    users = sorted(set(stored['user'].cat.categories) | set(tail['user'].cat.categories))
+    df = pd.concat([
+        stored.assign(user=stored['user'].cat.set_categories(users)),
+        tail.assign(user=tail['user'].cat.set_categories(users)),
+    ])
+    if 'User Code' in stored.columns:
+        # Same numbering as the OrdinalEncoder, users sorted by name
+        df['User Code'] = df['user'].cat.codes
+    return enforce_schema(df[stored.columns])
+
+
+def find_ingested_prefix(records: list, stored: pd.DataFrame, window: int = 20):
+    """Return how many leading records of a new export are already in `stored`, None if unknown.
+
+    The last stored message is looked up by user, text and timestamp and the `window`
+    messages ending at it must have the same content hash as the end of `stored`.
+    """
+    if stored.empty:
+        return 0
+
+    last_user = stored['user'].iloc[-1]
+    last_message = stored['message'].iloc[-1]
+    last_date = stored.index[-1]
+    window = min(window, len(stored))
+    stored_digest = messages_digest(stored['user'].iloc[-window:], stored['message'].iloc[-window:])
+
+    # Newer exports may have dropped messages from the start, so the match can sit earlier
+    for i in range(min(len(records), len(stored)) - 1, window - 2, -1):
+        message_date, user, message = records[i]
+        if user != last_user or message != last_message:
+            continue
+        if parse_message_dates(pd.Series([message_date])).iloc[0] != last_date:
+            continue
+        overlap = records[i - window + 1:i + 1]
+        if messages_digest([r[1] for r in overlap], [r[2] for r in overlap]) == stored_digest:
+            return i + 1
+    return None
+
+
+def messages_digest(users, messages):
+    digest = hashlib.sha256()
+    for user, message in zip(users, messages):
+        digest.update(f"{user}\0{message}\0".encode('utf-8'))
+    return digest.hexdigest()
+
+
+# Bump this whenever the preprocessed columns change so old cache entries are ignored
+CACHE_VERSION = 3
+CACHE_DIR = '.chat_cache'
+CACHE_MAX_BYTES = 500 * 1024 * 1024
+# The last few frames handed out stay loaded, asking again returns the same object, so the
+# results the dashboard helpers keep per frame (stats, token index, ...) are reused
+LOADED_FRAMES = OrderedDict()
+LOADED_FRAMES_MAX = 4
+
+
+def preprocess_cached(data: str, inter_conversation_threshold_time: int = 60,
+                      cache_dir: str = CACHE_DIR, max_cache_bytes: int = CACHE_MAX_BYTES):
+    """preprocess() backed by an on-disk Parquet cache keyed by the export's content.
+
+    Uploading the same chat again with the same options loads the stored frame instead
+    of parsing it. Once the cache grows past `max_cache_bytes` the least recently used
+    entries are deleted. The last LOADED_FRAMES_MAX frames are also kept in memory and
+    returned as the same object, call this on every rerun rather than caching the frame
+    with st.cache_data, which hands out a fresh copy each time.
+    """
+    key = cache_key(data, inter_conversation_threshold_time)
+    path = os.path.join(cache_dir, f"{key}.parquet")
+
+    if key in LOADED_FRAMES:
+        LOADED_FRAMES.move_to_end(key)
+        if os.path.exists(path):
+            # Reading counts as a use for the LRU eviction
+            os.utime(path)
+        return LOADED_FRAMES[key]
+
+    if os.path.exists(path):
+        df = pd.read_parquet(path)
+        df.index = df['date']
+        os.utime(path)
     else:
+        df = preprocess(data, inter_conversation_threshold_time)
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write under a temporary name so a crash never leaves a half written entry behind
+        df.to_parquet(f"{path}.tmp", index=False)
+        os.replace(f"{path}.tmp", path)
+        evict_cache(cache_dir, max_cache_bytes)
+
+    LOADED_FRAMES[key] = df
+    if len(LOADED_FRAMES) > LOADED_FRAMES_MAX:
+        LOADED_FRAMES.popitem(last=False)
+    return df
+
+
+def cache_key(data: str, inter_conversation_threshold_time: int = 60):
+    digest = hashlib.sha256()
+    digest.update(f"{CACHE_VERSION}:{inter_conversation_threshold_time}:".encode('utf-8'))
+    digest.update(data.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def evict_cache(cache_dir: str = CACHE_DIR, max_cache_bytes: int = CACHE_MAX_BYTES):
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith('.parquet'):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_cache_bytes:
+            break
+        os.remove(path)
+        total -= size
+
+
+def preprocess_chunks(path, chunk_size: int = 100000, encoding: str = 'utf-8',
+                      inter_conversation_threshold_time: int = 60):
+    """Yield the export at `path` as preprocessed frames of at most `chunk_size` messages.
+
+    The last message of every chunk is carried over to the next one, so conversation
+    codes, reply flags and reply times are the same as with a single preprocess() call.
+    'User Code' needs the whole participant list and is left out, the categories of
+    'user' only cover the participants seen in that chunk.
+    """
+    previous = None
+    with open(path, 'r', encoding=encoding) as file:
+        messages = read_messages(file)
+        while True:
+            chunk = list(islice(messages, chunk_size))
+            if not chunk:
+                break
+
+            df = pd.DataFrame(chunk, columns=MESSAGE_COLUMNS)
+            df = add_derived_columns(df, previous, participant_columns=False,
+                                     inter_conversation_threshold_time=inter_conversation_threshold_time)
+            previous = {
+                'date': df.index.values[-1],
+                'user': df['user'].iloc[-1],
+                'conv_code': df['Conv code'].iloc[-1],
+            }
+            yield df
+
+    if previous is None:
         raise ValueError("Unsupported data format")
 
-    # Parse the dates using dateutil.parser.parse
-    df['date'] = df['message_date'].apply(lambda x: parse(x, fuzzy=True))
+
+def preprocess_to_parquet(path, parquet_path, chunk_size: int = 100000, encoding: str = 'utf-8',
+                          inter_conversation_threshold_time: int = 60):
+    # Every chunk becomes one row group, so only one chunk is ever held in memory
+    writer = None
+    try:
+        for df in preprocess_chunks(path, chunk_size, encoding, inter_conversation_threshold_time):
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if writer is None:
+                # The user categories differ from chunk to chunk, a wide index type fits any later chunk
+                schema = table.schema
+                schema = schema.set(schema.get_field_index('user'),
+                                    pa.field('user', pa.dictionary(pa.int32(), pa.string())))
+                writer = pq.ParquetWriter(parquet_path, schema)
+            writer.write_table(table.cast(writer.schema))
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def add_derived_columns(df: pd.DataFrame, previous: dict = None, participant_columns: bool = True,
+                        inter_conversation_threshold_time: int = 60):
+    # `previous` holds the date, user and conversation code of the message right before df
+    previous_date = previous['date'] if previous else None
+    previous_user = previous['user'] if previous else None
+    previous_conv_code = previous['conv_code'] if previous else 0
+
+    df['date'] = parse_message_dates(df['message_date'])
     df.index = df['date']
     # df['Formatted Date'] = df.index.strftime('%b - %y').values
 
-    users = []
-    messages = []
-    for message in df['user_message']:
-        entry = re.split('([\w\W]+?):\s', message)
-        if entry[1:]:  # user name
-            users.append(entry[1])
-            messages.append(" ".join(entry[2:]))
-        else:
-            users.append('group_notification')
-            messages.append(entry[0])
-
-    df['user'] = users
-    df['message'] = messages
     df['Message Length'] = df['message'].apply(lambda x: len(x.split(' ')))
 
-    conv_codes, conv_changes = cluster_into_conversations(df)
+    conv_codes, conv_changes = cluster_into_conversations(df, inter_conversation_threshold_time,
+                                                          previous_date, previous_conv_code)
     df['Conv code'] = conv_codes
     df['Conv change'] = conv_changes
 
-    is_reply, sender_changes = find_replies(df)
+    is_reply, sender_changes = find_replies(df, previous_user)
     df['Is reply'] = is_reply
     df['Sender change'] = sender_changes
 
-    for subject in df['user'].unique():
-        df[subject] = df['user'].apply(lambda x: 1 if x == subject else 0)
-        df[f"{subject}_mlength"] = df[subject].values * df['Message Length']
+    # Users are stored once as categories, every row only keeps a small integer code
+    df['user'] = df['user'].astype('category')
 
-    df.drop(columns=['user_message', 'message_date'], inplace=True)
+    df.drop(columns=['message_date'], inplace=True)
 
-    df['only_date'] = df['date'].dt.date
+    df['only_date'] = df['date'].dt.normalize()
     df['year'] = df['date'].dt.year
     df['month_num'] = df['date'].dt.month
-    df['month'] = df['date'].dt.month_name()
+    # Names are categories over a fixed calendar order, every row keeps a one byte code
+    df['month'] = pd.Categorical.from_codes(df['month_num'].values - 1, dtype=MONTH_NAMES)
     df['day'] = df['date'].dt.day
-    df['day_name'] = df['date'].dt.day_name()
+    df['day_name'] = pd.Categorical.from_codes(df['date'].dt.dayofweek.values, dtype=DAY_NAMES)
     df['hour'] = df['date'].dt.hour
     df['minute'] = df['date'].dt.minute
 
+    df['period'] = pd.Categorical.from_codes(df['hour'].values, dtype=PERIOD_LABELS)
 
-
-    period = []
-    for hour in df[['day_name', 'hour']]['hour']:
-        if hour == 23:
-            period.append(str(hour) + "-" + str('00'))
-        elif hour == 0:
-            period.append(str('00') + "-" + str(hour + 1))
-        else:
-            period.append(str(hour) + "-" + str(hour + 1))
-
-    df['period'] = period
-
-
-    # Add logic for finding replies and calculating times
-    df = add_reply_logic(df)
+    # Users are numbered in name order like the OrdinalEncoder did, which is the category order
+    if participant_columns:
+        df['User Code'] = df['user'].cat.codes
 
     # Calculate times based on replies
-    reply_times, indices = calculate_times_on_trues(df, 'Is Reply')
-    reply_times_df_list = []
-    reply_time_index = 0
-    for i in range(0, len(df)):
-        if i in indices:
-            reply_times_df_list.append(reply_times[reply_time_index].astype("timedelta64[m]").astype("float"))
-            reply_time_index += 1
-        else:
-            reply_times_df_list.append(0)
-
-    df['Reply Time'] = reply_times_df_list
-
-    inter_conv_times, indices = calculate_times_on_trues(df, 'Conv change')
-    inter_conv_times_df_list = []
-    inter_conv_time_index = 0
-    for i in range(0, len(df)):
-        if i in indices:
-            inter_conv_times_df_list.append(
-                inter_conv_times[inter_conv_time_index].astype("timedelta64[m]").astype("float"))
-            inter_conv_time_index = inter_conv_time_index + 1
-        else:
-            inter_conv_times_df_list.append(0)
-
-    df['Inter conv time'] = inter_conv_times_df_list
-
-    df.to_csv("my_csv_data.csv", index=False)
-
-    return df
-
-def add_reply_logic(df):
-    # Ordinal encoders will encode each user with its own number
-    user_encoder = OrdinalEncoder()
-    df['User Code'] = user_encoder.fit_transform(df['user'].values.reshape(-1, 1))
-
-    # Find replies
-    message_senders = df['User Code'].values
-    sender_changed = (np.roll(message_senders, 1) - message_senders).reshape(1, -1)[0] != 0
-    sender_changed[0] = False
-    is_reply = sender_changed & ~df['user'].eq('group_notification')
-
-    df['Is Reply'] = is_reply
-
-
-
-    return df
-
-def calculate_times_on_trues(df : pd.DataFrame, column : str):
+    df['Reply Time'] = calculate_minutes_on_trues(df, 'Sender change', previous_date,
+                                                  ~df['user'].eq('group_notification').values)
+    df['Inter conv time'] = calculate_minutes_on_trues(df, 'Conv change', previous_date)
+
+    return enforce_schema(df)
+
+MONTH_NAMES = pd.CategoricalDtype(['January', 'February', 'March', 'April', 'May', 'June', 'July',
+                                   'August', 'September', 'October', 'November', 'December'], ordered=True)
+DAY_NAMES = pd.CategoricalDtype(['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'],
+                                ordered=True)
+# Hour of day as "23-00" style labels, used by the activity heatmap
+PERIOD_LABELS = pd.CategoricalDtype(['00-1'] + [f'{hour}-{hour + 1}' for hour in range(1, 23)] + ['23-00'],
+                                    ordered=True)
+
+
+# dtype of every column of a preprocessed chat. Calendar parts use the smallest integer
+# that fits, the chat-wide counters 32 bits, 'Is reply' is the one reply flag
+FRAME_SCHEMA = {
+    'user': 'category',
+    'message': 'object',
+    'date': 'datetime64[ns]',
+    'Message Length': 'int32',
+    'Conv code': 'int32',
+    'Conv change': 'bool',
+    'Is reply': 'bool',
+    'Sender change': 'bool',
+    'only_date': 'datetime64[ns]',
+    'year': 'int16',
+    'month_num': 'int8',
+    'month': MONTH_NAMES,
+    'day': 'int8',
+    'day_name': DAY_NAMES,
+    'hour': 'int8',
+    'minute': 'int8',
+    'period': PERIOD_LABELS,
+    'User Code': 'int16',
+    'Reply Time': 'int32',
+    'Inter conv time': 'int32',
+}
+
+
+def enforce_schema(df: pd.DataFrame):
+    """Cast the columns of a preprocessed chat to FRAME_SCHEMA, columns it doesn't know are kept as they are."""
+    return df.astype({column: dtype for column, dtype in FRAME_SCHEMA.items() if column in df.columns})
+
+
+def memory_report(df: pd.DataFrame):
+    """Bytes per message of every column as stored, and as plain strings for categorical columns."""
+    stored = df.memory_usage(index=False, deep=True)
+    as_strings = pd.Series({
+        name: column.astype(object).memory_usage(index=False, deep=True)
+        if isinstance(column.dtype, pd.CategoricalDtype) else stored[name]
+        for name, column in df.items()
+    })
+
+    report = pd.DataFrame({'stored': stored, 'as strings': as_strings}) / max(len(df), 1)
+    report.loc['total'] = report.sum()
+    return report.round(1)
+
+
+# Month-first formats, in the order dateutil would read an ambiguous date
+MESSAGE_DATE_FORMATS = [
+    '%m/%d/%y, %I:%M %p',
+    '%m/%d/%Y, %I:%M %p',
+    '%m/%d/%y, %H:%M',
+    '%m/%d/%Y, %H:%M',
+    '%m/%d/%y, %I:%M:%S %p',
+    '%m/%d/%Y, %I:%M:%S %p',
+]
+
+
+def detect_date_format(message_date: str):
+    for date_format in MESSAGE_DATE_FORMATS:
+        try:
+            datetime.strptime(message_date, date_format)
+            return date_format
+        except ValueError:
+            continue
+    return None
+
+
+def parse_message_dates(message_dates: pd.Series):
+    # Newer exports put a narrow no-break space before AM/PM
+    message_dates = message_dates.str.replace('\u202f', ' ', regex=False)
+
+    date_format = detect_date_format(message_dates.iloc[0]) if len(message_dates) else None
+    if date_format is None:
+        return pd.to_datetime(message_dates.apply(lambda x: parse(x, fuzzy=True)))
+
+    # Convert the whole column at once, only the rows that don't fit the format go through dateutil
+    dates = pd.to_datetime(message_dates, format=date_format, errors='coerce')
+    failed = dates.isna()
+    if failed.any():
+        dates[failed] = pd.to_datetime(message_dates[failed].apply(lambda x: parse(x, fuzzy=True)))
+    return dates
+
+
+def calculate_times_on_trues(df : pd.DataFrame, column : str, previous_date=None, mask=None):
     assert(column in df.columns)
-    true_indices = np.where(df[column])[0]
-    inter_conv_time = [df.index.values[ind] - df.index.values[ind-1] for ind in true_indices]
+    flags = df[column].values if mask is None else df[column].values & mask
+    true_indices = np.where(flags)[0]
+    previous_dates = np.roll(df.index.values, 1)
+    if previous_date is not None:
+        previous_dates[0] = previous_date
+    inter_conv_time = df.index.values[true_indices] - previous_dates[true_indices]
     return inter_conv_time, true_indices
 
 
+def calculate_minutes_on_trues(df : pd.DataFrame, column : str, previous_date=None, mask=None):
+    # Whole minutes since the previous message on the flagged rows, 0 everywhere else
+    times, indices = calculate_times_on_trues(df, column, previous_date, mask)
+    minutes = np.zeros(len(df))
+    minutes[indices] = times.astype("timedelta64[m]").astype("float")
+    return minutes
+
+
 ####Working fine till here####
 
 ##Section to get the conversation changes data not working here
 
-def cluster_into_conversations(df: pd.DataFrame, inter_conversation_threshold_time: int = 60):
+def cluster_into_conversations(df: pd.DataFrame, inter_conversation_threshold_time: int = 60,
+                               previous_date=None, first_conv_code: int = 0):
     threshold_time_mins = np.timedelta64(inter_conversation_threshold_time, 'm')
 
     # This calculates the time between the current message and the previous one
     conv_delta = df.index.values - np.roll(df.index.values, 1)
-    conv_delta[0] = 0
+    conv_delta[0] = 0 if previous_date is None else df.index.values[0] - previous_date
 
     # This detects where the time between messages is higher than the threshold
     conv_changes = conv_delta > threshold_time_mins
-    conv_changes_indices = np.where(conv_changes)[0]
-    conv_codes = []
-
-    if len(conv_changes_indices) == 0:
-        # If there are no changes in conversation, assign all messages to a single conversation
-        conv_codes = [0] * len(df)
-    else:
-        # Otherwise, assign conversation codes based on the detected changes
-        last_conv_change = 0
-        for i, conv_change in enumerate(conv_changes_indices):
-            conv_codes.extend([i] * (conv_change - last_conv_change))
-            last_conv_change = conv_change
-        conv_codes.extend([len(conv_changes_indices)] * (len(df) - conv_changes_indices[-1]))
 
-    # This serves to ensure that the conversation codes and the number of messages are aligned
-    conv_codes = pad_list_to_value(conv_codes, len(df), conv_codes[-1])
-    conv_changes = pad_list_to_value(conv_changes, len(df), False)
+    # Every change starts a new conversation, so the code is the running count of changes
+    conv_codes = np.cumsum(conv_changes) + first_conv_code
 
     return conv_codes, conv_changes
 
 
-def pad_list_to_value(input_list : list, length : int, value):
-    assert(length >= len(input_list))
-    output_list = list(input_list)
-    padding = [value]*(length - len(output_list))
-    output_list.extend(padding)
-    return np.array(output_list)
+def recluster_conversations(df: pd.DataFrame, inter_conversation_threshold_time: int = 60):
+    """Redo the conversation split of a preprocessed frame with another threshold.
 
+    Only the columns that depend on the threshold are recomputed, so the dashboard can
+    move the threshold without parsing the export again.
+    """
+    conv_codes, conv_changes = cluster_into_conversations(df, inter_conversation_threshold_time)
+    df = df.assign(**{
+        'Conv code': conv_codes,
+        'Conv change': conv_changes,
+        'Is reply': df['Sender change'] & ~conv_changes,
+    })
+    df['Inter conv time'] = calculate_minutes_on_trues(df, 'Conv change')
+    return enforce_schema(df)
 
-def find_replies(df : pd.DataFrame):
+
+def find_replies(df : pd.DataFrame, previous_user=None):
     # These are sanity checks in order to see if I made any ordering mistakes
     assert('Conv code' in df.columns)
     assert('Conv change' in df.columns)
@@ -248,9 +474,15 @@ def find_replies(df : pd.DataFrame):
     # This compares the current subject with the previous subject
     # In a way that computers can optimize
     sender_changed = (np.roll(message_senders, 1) - message_senders).reshape(1, -1)[0] != 0
-    sender_changed[0] = False
+    sender_changed[0] = previous_user is not None and df['user'].iloc[0] != previous_user
     # This checks if the reply isn't within a different conversation
     is_reply = sender_changed & ~df['Conv change']
     return is_reply, sender_changed
 
 
+if __name__ == '__main__':
+    import sys
+
+    with open(sys.argv[1], 'r', encoding='utf-8') as file:
+        df = preprocess(file)
+    print(memory_report(df))
@@ -0,0 +1,56 @@
+"""Time the reply and inter-conversation time columns on synthetic chats.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_reply_times
+
+Both columns are array operations, so the time per message should stay about the
+same from 10k to 1M messages. A quadratic step shows up as a per-message time that
+grows with the chat.
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+from backend.preprocessor import calculate_minutes_on_trues, cluster_into_conversations, find_replies
+
+SIZES = [10_000, 100_000, 1_000_000]
+REPEATS = 3
+
+
+def synthetic_chat(n, seed=0):
+    rng = np.random.default_rng(seed)
+    # Seconds between messages, mostly quick back and forth, sometimes hours or days of silence
+    gaps = rng.choice([0, 15, 60, 300, 1800, 5400, 36000, 180000], size=n,
+                      p=[.25, .3, .2, .1, .07, .05, .02, .01])
+    dates = pd.Timestamp('2000-01-01') + pd.to_timedelta(np.cumsum(gaps), unit='s')
+    df = pd.DataFrame({'user': rng.choice(['Alice', 'Bob', 'Carol', 'Dan'], size=n)}, index=dates)
+
+    conv_codes, conv_changes = cluster_into_conversations(df)
+    df['Conv code'] = conv_codes
+    df['Conv change'] = conv_changes
+    df['Is reply'], df['Sender change'] = find_replies(df)
+    return df
+
+
+def best_of(function, repeats=REPEATS):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    print(f"{'messages':>10} {'Reply Time':>12} {'Inter conv':>12} {'ns/message':>12}")
+    for n in SIZES:
+        df = synthetic_chat(n)
+        reply = best_of(lambda: calculate_minutes_on_trues(df, 'Sender change'))
+        inter = best_of(lambda: calculate_minutes_on_trues(df, 'Conv change'))
+        print(f"{n:>10,} {reply:>11.4f}s {inter:>11.4f}s {(reply + inter) / n * 1e9:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
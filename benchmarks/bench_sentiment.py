@@ -0,0 +1,43 @@
+"""Messages per second of the VADER sentiment stage with 1, 2, 4 and 8 workers.
+
+Run from the repository root, optionally with the number of messages:
+
+    python -m benchmarks.bench_sentiment 200000
+
+Every message is distinct and the score cache is cleared before each run, so all
+messages really go through VADER. Past the core count extra workers only add overhead.
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+from backend.helper import message_sentiment, score_messages
+
+WORKERS = [1, 2, 4, 8]
+WORDS = ['good', 'bad', 'great', 'terrible', 'ok', 'love', 'hate', 'meh', 'lol', 'sure', 'the', 'movie',
+         'was', 'not', 'really', 'very', 'happy', 'sad', 'today', 'tomorrow', 'call', 'me', '!', ':)']
+
+
+def synthetic_messages(n, seed=0):
+    rng = np.random.default_rng(seed)
+    words = rng.choice(WORDS, size=(n, 8))
+    # The number at the end keeps every message distinct
+    return [' '.join(row) + f' {i}' for i, row in enumerate(words)]
+
+
+def main(n=100_000):
+    messages = synthetic_messages(n)
+    print(f"{n:,} messages, {os.cpu_count()} cores")
+    print(f"{'workers':>8} {'seconds':>9} {'messages/s':>12}")
+    for workers in WORKERS:
+        message_sentiment.cache_clear()
+        start = time.perf_counter()
+        score_messages(messages, workers)
+        elapsed = time.perf_counter() - start
+        print(f"{workers:>8} {elapsed:>9.2f} {n / elapsed:>12,.0f}")
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:2]))
@@ -1,182 +1,195 @@
 import json
+import os
 import re
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
 
+import numpy as np
 import pandas as pd
-from datetime import datetime
 import plotly.express as px
 
-# Load JSON data from file
-with open('chat_data.json', 'r', encoding='utf-8') as file:
-    json_data = json.load(file)
+HASHTAG_PATTERN = r'#(\w+)'
+MENTION_PATTERN = r'@(\w+)'
 
-
-# Define a function to extract hashtags from a message
-def extract_hashtags(message):
-    hashtags = re.findall(r'#(\w+)', message)
-    return hashtags
-
-
-# Define a function to extract mentions from a message
-def extract_mentions(message):
-    mentions = re.findall(r'@(\w+)', message)
-    return mentions
+COLUMNS = ['date', 'date_only', 'year', 'month', 'month_num', 'day', 'day_name', 'hour', 'minute', 'user', 'message',
+           'message_length', 'message_type', 'reactions_count', 'word_count', 'avg_word_length', 'hashtags', 'mentions',
+           'media_type', 'reel_link', 'stories_link', 'post_link']
 
 
-# Define a function to extract URLs from a message
-def extract_urls(message):
-    urls = re.findall(r'(https?://\S+)', message)
-    return urls
+def fix_mojibake(text: pd.Series):
+    # Instagram writes UTF-8 bytes as if they were Latin-1 characters
+    return text.str.encode("Latin1").str.decode("UTF-8")
 
 
-# Define a function to categorize media type from attachment URLs
-def categorize_media_type(message):
-    if 'share' in message and 'link' in message['share']:
-        attachment_url = message['share']['link']
-        if attachment_url.endswith('.jpg') or attachment_url.endswith('.png'):
-            return 'image'
-        elif attachment_url.endswith('.mp4') or attachment_url.endswith('.mov'):
-            return 'video'
-    return 'other'
+def load_instagram_chat(json_data: dict):
+    """Build the message frame of one Instagram chat export (a parsed message_N.json)."""
+    messages = pd.DataFrame(json_data['messages'])
+    for column in ['sender_name', 'timestamp_ms', 'content', 'share', 'reactions']:
+        if column not in messages.columns:
+            messages[column] = None
 
-# Initialize lists to store data
-data_rows = []
+    df = pd.DataFrame(index=messages.index)
 
-# Iterate through messages
-for message in json_data['messages']:
-    # Convert timestamp to datetime object
-    timestamp_ms = message['timestamp_ms'] / 1000
-    date = datetime.utcfromtimestamp(timestamp_ms).strftime('%Y-%m-%d %H:%M:%S')
-    date_only = datetime.utcfromtimestamp(timestamp_ms).strftime('%Y-%m-%d')
-    year = datetime.utcfromtimestamp(timestamp_ms).strftime('%Y')
-    month = datetime.utcfromtimestamp(timestamp_ms).strftime('%B')
-    month_num = datetime.utcfromtimestamp(timestamp_ms).strftime('%m')
-    day = datetime.utcfromtimestamp(timestamp_ms).strftime('%d')
-    day_name = datetime.utcfromtimestamp(timestamp_ms).strftime('%A')
-    hour = datetime.utcfromtimestamp(timestamp_ms).strftime('%H')
-    minute = datetime.utcfromtimestamp(timestamp_ms).strftime('%M')
+    # Convert timestamps to datetimes in one go and read the calendar parts off them
+    dates = pd.to_datetime(messages['timestamp_ms'], unit='ms')
+    df['date'] = dates
+    df['date_only'] = dates.dt.normalize()
+    df['year'] = dates.dt.year
+    df['month'] = dates.dt.month_name()
+    df['month_num'] = dates.dt.month
+    df['day'] = dates.dt.day
+    df['day_name'] = dates.dt.day_name()
+    df['hour'] = dates.dt.hour
+    df['minute'] = dates.dt.minute
 
     # Get message content or set it to an empty string if not present
-    message_content = message.get('content', '')
+    content = fix_mojibake(messages['content'].fillna(''))
+    df['user'] = fix_mojibake(messages['sender_name'])
+    df['message'] = content
+    df['message_length'] = content.str.len()
 
     # Determine message type
-    if 'share' in message:
-        message_type = 'attachment'
-        # Check if the attachment contains a link
-        if 'link' in message['share']:
-            attachment_link = message['share']['link']
-            # Check the type of link and append it to the appropriate list
-            if attachment_link.startswith('https://www.instagram.com/reel/'):
-                reel_link = attachment_link
-                stories_link = ''
-                post_link = ''
-            elif attachment_link.startswith('https://instagram.com/stories/'):
-                reel_link = ''
-                stories_link = attachment_link
-                post_link = ''
-            elif attachment_link.startswith('https://www.instagram.com/p/'):
-                reel_link = ''
-                stories_link = ''
-                post_link = attachment_link
-            else:
-                reel_link = ''
-                stories_link = ''
-                post_link = ''
-        else:
-            # If the 'link' key is not present, set all link columns to empty strings
-            reel_link = ''
-            stories_link = ''
-            post_link = ''
-    elif 'reactions' in message:
-        message_type = 'reaction'
-        reel_link = ''
-        stories_link = ''
-        post_link = ''
-    else:
-        message_type = 'text'
-        reel_link = ''
-        stories_link = ''
-        post_link = ''
+    has_share = messages['share'].notna()
+    has_reactions = messages['reactions'].notna()
+    df['message_type'] = np.select([has_share, has_reactions], ['attachment', 'reaction'], default='text')
 
     # Count reactions
-    reactions_count = len(message.get('reactions', []))
+    df['reactions_count'] = pd.to_numeric(messages['reactions'].str.len()).fillna(0).astype(int)
 
     # Calculate word count and average word length
-    words = message_content.split()
-    word_count = len(words)
-    if word_count > 0:
-        avg_word_length = sum(len(word) for word in words) / word_count
+    word_count = content.str.split().str.len()
+    letters = content.str.replace(r'\s+', '', regex=True).str.len()
+    df['word_count'] = word_count
+    df['avg_word_length'] = (letters / word_count.where(word_count > 0)).fillna(0)
+
+    # Extract hashtags and mentions
+    df['hashtags'] = content.str.findall(HASHTAG_PATTERN)
+    df['mentions'] = content.str.findall(MENTION_PATTERN)
+
+    # Categorize media type and sort shared links by what they point to
+    link = messages['share'].str.get('link').fillna('')
+    df['media_type'] = np.select(
+        [link.str.endswith(('.jpg', '.png')), link.str.endswith(('.mp4', '.mov'))],
+        ['image', 'video'],
+        default='other',
+    )
+    df['reel_link'] = link.where(link.str.startswith('https://www.instagram.com/reel/'), '')
+    df['stories_link'] = link.where(link.str.startswith('https://instagram.com/stories/'), '')
+    df['post_link'] = link.where(link.str.startswith('https://www.instagram.com/p/'), '')
+
+    return df[COLUMNS]
+
+
+# Every thread lives in inbox/<thread>/ and is split into message_1.json, message_2.json, ...
+MESSAGE_PART = re.compile(r'(?:^|/)inbox/([^/]+)/message_(\d+)\.json$')
+
+
+def find_message_parts(names):
+    parts = []
+    for name in names:
+        match = MESSAGE_PART.search(name.replace(os.sep, '/'))
+        if match:
+            parts.append((match.group(1), int(match.group(2)), name))
+    return [name for _, _, name in sorted(parts)]
+
+
+def load_instagram_part(source):
+    # `source` is (zip path or None, file path), kept picklable for the process pool
+    archive, name = source
+    if archive is None:
+        with open(name, 'r', encoding='utf-8') as file:
+            json_data = json.load(file)
     else:
-        avg_word_length = 0
+        with zipfile.ZipFile(archive) as zip_file:
+            json_data = json.loads(zip_file.read(name).decode('utf-8'))
 
-    # Extract hashtags, mentions, and URLs
-    hashtags = extract_hashtags(message_content)
-    mentions = extract_mentions(message_content)
-    urls = extract_urls(message_content)
+    df = load_instagram_chat(json_data)
+    df['thread_path'] = json_data.get('thread_path', os.path.dirname(name))
+    df['title'] = fix_mojibake(pd.Series([json_data.get('title', '')])).iloc[0]
+    return df
 
-    # Categorize media type
-    media_type = categorize_media_type(message)
 
-    # Append data row to list
-    data_rows.append(
-        [date, date_only, year, month, month_num, day, day_name, hour, minute, message['sender_name'].encode("Latin1").decode("UTF-8"), message_content.encode("Latin1").decode("UTF-8"),
-         len(message_content), message_type, reactions_count, word_count, avg_word_length, hashtags, mentions,
-         media_type, reel_link, stories_link, post_link])
+def load_instagram_export(path, max_workers: int = None):
+    """Load every thread of an Instagram data download, a directory or the zip itself.
 
-# Create DataFrame
-columns = ['date', 'date_only', 'year', 'month', 'month_num', 'day', 'day_name', 'hour', 'minute', 'user', 'message',
-           'message_length', 'message_type', 'reactions_count', 'word_count', 'avg_word_length', 'hashtags', 'mentions',
-           'media_type', 'reel_link', 'stories_link', 'post_link']
-df = pd.DataFrame(data_rows, columns=columns)
-
-# Display the DataFrame
-print(df.head())
-
-import streamlit as st
-from backend import helper
-st.write(df)
-
-
-num_messages, words, num_media_messages, num_links = helper.fetch_stats("Overall", df)
-st.title("Top Statistics")
-col1, col2, col3, col4 = st.columns(4)
-
-with col1:
-    st.header("Total Messages")
-    st.metric(" ", num_messages)
-with col2:
-    st.header("Total Words")
-    st.metric(" ", words)
-with col3:
-    st.header("Media Shared")
-    st.metric(" ", num_media_messages)
-with col4:
-    st.header("Links Shared")
-    st.metric(" ", num_links)
-
-# helper.create_wordcloud("Overall",df)
-helper.most_busy_users(df)
-
-st.title('Most Busy Users')
-x, new_df = helper.most_busy_users(df)
-# fig, ax = plt.subplots()
-
-# Create a bar plot using Plotly Express
-fig = px.bar(x=x.index, y=x.values, labels={'x': 'User', 'y': 'Count'})
-fig.update_layout(title="Most Busy Users")
-fig.update_xaxes(title_text='User', tickangle=-45)
-fig.update_yaxes(title_text='Count')
-st.plotly_chart(fig)
-
-st.dataframe(new_df)
-
-st.title("Wordcloud")
-
-# df_wc = helper.create_wordcloud(selected_user, df)
-# fig, ax = plt.subplots()
-# ax.imshow(df_wc)
-# plt.axis("off")
-# st.pyplot(fig)
-#
-# wordcloud_fig = helper.create_plotly_wordcloud("Overall", df)
-# st.plotly_chart(wordcloud_fig)
+    The message_N.json files are parsed across a process pool, the result is one frame
+    with 'thread_path' and 'title' columns telling the threads apart.
+    """
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as zip_file:
+            sources = [(path, name) for name in find_message_parts(zip_file.namelist())]
+    else:
+        names = [os.path.join(root, file) for root, _, files in os.walk(path) for file in files]
+        sources = [(None, name) for name in find_message_parts(names)]
+
+    if not sources:
+        raise ValueError(f"No inbox/<thread>/message_N.json files found in {path}")
+
+    if max_workers == 1 or len(sources) == 1:
+        frames = [load_instagram_part(source) for source in sources]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            frames = list(executor.map(load_instagram_part, sources))
+
+    return pd.concat(frames, ignore_index=True)
+
+
+if __name__ == '__main__':
+    # Load JSON data from file
+    with open('chat_data.json', 'r', encoding='utf-8') as file:
+        json_data = json.load(file)
+
+    df = load_instagram_chat(json_data)
+
+    # Display the DataFrame
+    print(df.head())
+
+    import streamlit as st
+    from backend import helper
+    st.write(df)
+
+
+    num_messages, words, num_media_messages, num_links = helper.fetch_stats("Overall", df)
+    st.title("Top Statistics")
+    col1, col2, col3, col4 = st.columns(4)
+
+    with col1:
+        st.header("Total Messages")
+        st.metric(" ", num_messages)
+    with col2:
+        st.header("Total Words")
+        st.metric(" ", words)
+    with col3:
+        st.header("Media Shared")
+        st.metric(" ", num_media_messages)
+    with col4:
+        st.header("Links Shared")
+        st.metric(" ", num_links)
+
+    # helper.create_wordcloud("Overall",df)
+    helper.most_busy_users(df)
+
+    st.title('Most Busy Users')
+    x, new_df = helper.most_busy_users(df)
+    # fig, ax = plt.subplots()
+
+    # Create a bar plot using Plotly Express
+    fig = px.bar(x=x.index, y=x.values, labels={'x': 'User', 'y': 'Count'})
+    fig.update_layout(title="Most Busy Users")
+    fig.update_xaxes(title_text='User', tickangle=-45)
+    fig.update_yaxes(title_text='Count')
+    st.plotly_chart(fig)
+
+    st.dataframe(new_df)
+
+    st.title("Wordcloud")
+
+    # df_wc = helper.create_wordcloud(selected_user, df)
+    # fig, ax = plt.subplots()
+    # ax.imshow(df_wc)
+    # plt.axis("off")
+    # st.pyplot(fig)
+    #
+    # wordcloud_fig = helper.create_plotly_wordcloud("Overall", df)
+    # st.plotly_chart(wordcloud_fig)
 
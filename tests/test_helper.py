@@ -0,0 +1,117 @@
+from collections import Counter
+
+import emoji
+import pandas as pd
+
+from backend import helper, preprocessor
+
+
+# Messages with and without links, the prefilter must never skip one URLExtract finds
+LINK_CORPUS = [
+    "see https://example.com/a?b=1 ok",
+    "www.google.com",
+    "bare example.com here",
+    "example.co.uk.",
+    "google.com/maps",
+    "t.co/abc",
+    "x.io",
+    "two links a.com b.org",
+    "ftp://files.example.net",
+    "end of sentence.Next one",
+    "ip 192.168.0.1 and 10.0.0.1:8080/x",
+    "https://[2001:db8::1]/",
+    "[2001:db8::1]",
+    "http://localhost:8000/api",
+    "LOCALHOST:3000",
+    "localhost",
+    "münchen.de",
+    "xn--p1ai.xn--p1ai",
+    "пример.рф",
+    "例子.中国",
+    "例子。中国",
+    "pi is 3.14",
+    "version 1.2.3",
+    "price 4.50$",
+    "tel 9876.543",
+    "file.txt and report.pdf",
+    "user@example.com",
+    "e.mail me a@b.com",
+    "ok...",
+    "a.b",
+    "hello",
+    "<Media omitted>\n",
+    "",
+]
+
+
+def test_count_links_matches_urlextract():
+    expected = [len(helper.extract.find_urls(message)) for message in LINK_CORPUS]
+
+    links = helper.count_links(pd.Series(LINK_CORPUS))
+
+    assert links.tolist() == expected
+
+
+def test_count_links_keeps_the_index():
+    messages = pd.Series(["see example.com", "hello"], index=pd.to_datetime(['2024-01-01', '2024-01-02']))
+
+    links = helper.count_links(messages)
+
+    assert links.index.equals(messages.index)
+    assert links.tolist() == [1, 0]
+
+
+EMOJI_CHAT = pd.DataFrame({
+    'user': pd.Categorical(['Alice', 'Bob', 'Alice', 'Bob', 'Alice', 'Bob']),
+    'message': [
+        "love you ❤ ❤ ♥ ☺",
+        "☹ ☝ ☀ and ❤️ 👍🏽👍",
+        "family 👨‍👩‍👧 at home 👩🏽‍💻",
+        "🇮🇳 🇬🇧 ™️ ↔ #️⃣",
+        "no emoji here",
+        "😂😂😂 ☝🏽 🏴󠁧󠁢󠁳󠁣󠁴󠁿",
+    ],
+})
+
+
+def per_character_counts(emojis):
+    # What emoji_helper counted before, every code point that is an emoji on its own
+    return Counter(char for text in emojis for char in text if char in emoji.UNICODE_EMOJI['en'])
+
+
+def test_emoji_counts_match_the_per_character_count():
+    table = helper.emoji_table(EMOJI_CHAT)
+
+    found = [text for text, count in zip(table['emoji'], table['count']) for _ in range(count)]
+
+    assert per_character_counts(found) == per_character_counts(EMOJI_CHAT['message'])
+
+
+def test_emoji_sequences_stay_whole():
+    counts = dict(helper.emoji_helper('Overall', EMOJI_CHAT).values)
+
+    assert counts['❤'] == 2
+    assert counts['♥'] == counts['☺'] == counts['☹'] == counts['☀'] == 1
+    for sequence in ['👨‍👩‍👧', '👩🏽‍💻', '👍🏽', '☝🏽', '🇮🇳', '🇬🇧', '#️⃣', '🏴󠁧󠁢󠁳󠁣󠁴󠁿']:
+        assert counts[sequence] == 1, sequence
+    assert counts['😂'] == 3
+    assert set(dict(helper.emoji_helper('Bob', EMOJI_CHAT).values)) >= {'☹', '👍🏽', '🇮🇳', '😂'}
+
+
+def test_fetch_stats_reuses_the_stats_of_a_cached_chat(tmp_path, monkeypatch):
+    chat = (
+        "12/31/23, 10:15 PM - Alice: see example.com\n"
+        "12/31/23, 11:59 PM - Bob: nice\n"
+        "1/1/24, 12:01 AM - Alice: ok\n"
+    )
+    monkeypatch.setattr(preprocessor, 'LOADED_FRAMES', preprocessor.OrderedDict())
+    calls = []
+    count_links = helper.count_links
+    monkeypatch.setattr(helper, 'count_links', lambda messages: calls.append(1) or count_links(messages))
+
+    first = helper.fetch_stats('Alice', preprocessor.preprocess_cached(chat, cache_dir=tmp_path))
+    second = helper.fetch_stats('Bob', preprocessor.preprocess_cached(chat, cache_dir=tmp_path))
+
+    assert first == (2, 3, 0, 1)
+    assert second == (1, 1, 0, 0)
+    assert len(calls) == 1
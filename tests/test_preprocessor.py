@@ -0,0 +1,97 @@
+import io
+
+import pandas as pd
+import pytest
+from dateutil.parser import parse
+
+from backend import preprocessor
+
+
+ANDROID_CHAT = (
+    "12/31/23, 10:15 PM - Alice: Happy new year!\n"
+    "12/31/23, 11:59 PM - Bob: You too\n"
+    "see you tomorrow\n"
+    "1/1/24, 12:01 AM - Alice: 🎉\n"
+    "1/1/24, 9:05 AM - Bob added Carol\n"
+    "1/2/24, 1:30\u202fPM - Carol: <Media omitted>\n"
+    "1/15/24, 4:45 PM - Bob: note: colons stay in the message\n"
+)
+
+IOS_CHAT = (
+    "[12/31/23, 10:15:30 PM] Alice: Happy new year!\n"
+    "[12/31/23, 11:59:02 PM] Bob: You too\n"
+    "see you tomorrow\n"
+    "[1/1/24, 12:01:45 AM] Alice: 🎉\n"
+    "[1/2/24, 1:30:00\u202fPM] Carol: image omitted\n"
+    "[1/15/24, 4:45:59 PM] Bob: note: colons stay in the message\n"
+)
+
+
+def dateutil_dates(message_dates):
+    # What preprocess() did for every row before the vectorized path
+    return pd.to_datetime([parse(date.replace('\u202f', ' '), fuzzy=True) for date in message_dates])
+
+
+@pytest.mark.parametrize('chat', [ANDROID_CHAT, IOS_CHAT], ids=['android', 'ios'])
+def test_dates_match_dateutil(chat):
+    message_dates = [date for date, _, _ in preprocessor.read_messages(io.StringIO(chat))]
+
+    df = preprocessor.preprocess(chat)
+
+    assert (df['date'].values == dateutil_dates(message_dates).values).all()
+
+
+@pytest.mark.parametrize('chat', [ANDROID_CHAT, IOS_CHAT], ids=['android', 'ios'])
+def test_dateutil_fallback_matches_fast_path(chat):
+    message_dates = pd.Series([date for date, _, _ in preprocessor.read_messages(io.StringIO(chat))])
+    # A first row in no known format sends the whole column through dateutil
+    fallback = preprocessor.parse_message_dates(pd.concat([pd.Series(['2023-12-31 22:15']), message_dates]))
+
+    fast = preprocessor.parse_message_dates(message_dates)
+
+    assert (fallback.values[1:] == fast.values).all()
+
+
+def test_rows_outside_the_detected_format_fall_back_to_dateutil():
+    message_dates = pd.Series(['12/31/23, 10:15 PM', '12/31/23, 23:59', '1/1/24, 12:01 AM'])
+
+    dates = preprocessor.parse_message_dates(message_dates)
+
+    assert (dates.values == dateutil_dates(message_dates).values).all()
+
+
+def assert_schema(df, schema=preprocessor.FRAME_SCHEMA):
+    assert list(df.columns) == list(schema)
+    for column, dtype in schema.items():
+        assert df[column].dtype == dtype, column
+
+
+@pytest.mark.parametrize('chat', [ANDROID_CHAT, IOS_CHAT], ids=['android', 'ios'])
+def test_preprocess_enforces_schema(chat):
+    assert_schema(preprocessor.preprocess(chat))
+
+
+def test_incremental_ingest_keeps_schema():
+    lines = ANDROID_CHAT.splitlines(keepends=True)
+    stored = preprocessor.preprocess(''.join(lines[:3]))
+
+    df = preprocessor.preprocess_incremental(ANDROID_CHAT, stored)
+
+    assert len(df) == len(preprocessor.preprocess(ANDROID_CHAT))
+    assert_schema(df)
+
+
+def test_recluster_keeps_schema():
+    df = preprocessor.preprocess(ANDROID_CHAT)
+
+    assert_schema(preprocessor.recluster_conversations(df, 5))
+
+
+def test_chunks_keep_schema(tmp_path):
+    path = tmp_path / 'chat.txt'
+    path.write_text(ANDROID_CHAT, encoding='utf-8')
+    # Chunks leave out 'User Code', it needs the whole participant list
+    schema = {column: dtype for column, dtype in preprocessor.FRAME_SCHEMA.items() if column != 'User Code'}
+
+    for df in preprocessor.preprocess_chunks(path, chunk_size=2):
+        assert_schema(df, schema)